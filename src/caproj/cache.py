@@ -0,0 +1,262 @@
+"""
+caproj.cache
+~~~~~~~~~~~~
+
+This module contains a persistent on-disk cache for the interval datasets
+generated by :func:`caproj.datagen.generate_interval_data`
+
+**Module classes:**
+
+.. autosummary::
+
+   IntervalCache
+
+**Module functions:**
+
+.. autosummary::
+
+   hash_file
+   cached_interval_data
+
+"""
+
+import glob
+import hashlib
+import os
+import tempfile
+
+import caproj
+from .datagen import (
+    generate_interval_data,
+    load_interval_data,
+    read_change_records,
+    save_interval_data,
+)
+
+# memoized file hashes, keyed by (path, size, modification time)
+_file_hashes = {}
+
+
+def hash_file(filepath, blocksize=2 ** 20):
+    """Returns the SHA-256 hex digest of a file's contents
+
+    Digests are memoized for the life of the Python process, so an unchanged
+    file (same path, size and modification time) is only read once.
+
+    :param filepath: string path of the file to hash
+    :param blocksize: integer number of bytes read at a time (default
+                      blocksize=1048576)
+
+    :return: string hex digest of the file contents
+    """
+    stat = os.stat(filepath)
+    memo_key = (os.path.abspath(filepath), stat.st_size, stat.st_mtime_ns)
+
+    if memo_key not in _file_hashes:
+        digest = hashlib.sha256()
+        with open(filepath, "rb") as f:
+            for block in iter(lambda: f.read(blocksize), b""):
+                digest.update(block)
+        _file_hashes[memo_key] = digest.hexdigest()
+
+    return _file_hashes[memo_key]
+
+
+class IntervalCache:
+    """Content-addressed, size-bounded on-disk cache of interval datasets
+
+    Entries are keyed by the hash of the input file's contents, the
+    ``change_year_interval``, the ``inclusive_stop`` setting and the installed
+    ``caproj`` version, and are stored as Parquet files. When the total size
+    of the cache exceeds ``max_bytes``, the least recently used entries are
+    evicted.
+
+    :param cache_dir: string path of the cache directory, created if it does
+                      not exist (default cache_dir='../data/interim/cache/')
+    :param max_bytes: integer maximum total size of the cached files in bytes
+                      (default max_bytes=2147483648, i.e. 2 GiB)
+    """
+
+    def __init__(self, cache_dir="../data/interim/cache/", max_bytes=2 ** 31):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, filepath, change_year_interval=None, inclusive_stop=True):
+        """Returns the cache key for an input file and interval settings
+
+        :param filepath: string path of the change records input file
+        :param change_year_interval: integer or None, as passed to
+                                     generate_interval_data() (default None)
+        :param inclusive_stop: boolean, as passed to generate_interval_data()
+                               (default True)
+
+        :return: string key, prefixed by the input file's content hash
+        """
+        params = "{}|{}|{}".format(
+            change_year_interval,
+            inclusive_stop,
+            getattr(caproj, "__version__", "unknown"),
+        )
+
+        return "{}-{}".format(
+            hash_file(filepath),
+            hashlib.sha256(params.encode()).hexdigest()[:16],
+        )
+
+    def _path(self, key):
+        """Returns the file path of a cache entry"""
+        return os.path.join(self.cache_dir, "{}.parquet".format(key))
+
+    def get(self, key):
+        """Returns the cached dataframe for key, or None on a cache miss
+
+        An entry that cannot be read is treated as a miss and removed, so that
+        it is regenerated by the next put().
+
+        :param key: string key generated by IntervalCache.key()
+
+        :return: pd.DataFrame or None
+        """
+        path = self._path(key)
+
+        if not os.path.exists(path):
+            return None
+
+        try:
+            # mark the entry as recently used
+            os.utime(path)
+            return load_interval_data(path, file_format="parquet")
+        except (OSError, ValueError):
+            if os.path.exists(path):
+                os.remove(path)
+            return None
+
+    def put(self, key, df):
+        """Stores a dataframe under key and evicts entries if over max_bytes
+
+        The dataframe is written to a temporary file in the cache directory,
+        which is then moved into place, so that concurrent readers never see
+        a partially written entry.
+
+        :param key: string key generated by IntervalCache.key()
+        :param df: pd.DataFrame of interval data to cache
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        os.close(fd)
+
+        try:
+            save_interval_data(df, tmp_path, file_format="parquet")
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        self.evict()
+
+    def entries(self):
+        """Returns the cache entry file paths, least recently used first
+
+        :return: list of string file paths
+        """
+        return sorted(
+            glob.glob(os.path.join(self.cache_dir, "*.parquet")),
+            key=os.path.getmtime,
+        )
+
+    def evict(self):
+        """Removes least recently used entries until within max_bytes"""
+        entries = self.entries()
+        total_bytes = sum(os.path.getsize(path) for path in entries)
+
+        for path in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            total_bytes -= os.path.getsize(path)
+            os.remove(path)
+
+    def invalidate(self, key=None, filepath=None):
+        """Removes the entry for key, or all entries for an input file
+
+        :param key: string key of a single entry to remove (default None)
+        :param filepath: string path of an input file, all entries generated
+                         from the current contents of that file are removed
+                         (default None)
+        """
+        if key is not None:
+            paths = [self._path(key)]
+        elif filepath is not None:
+            paths = glob.glob(
+                os.path.join(
+                    self.cache_dir, "{}-*.parquet".format(hash_file(filepath))
+                )
+            )
+        else:
+            raise ValueError("invalidate requires either a key or a filepath")
+
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def clear(self):
+        """Removes all entries from the cache"""
+        for path in self.entries():
+            os.remove(path)
+
+
+def cached_interval_data(
+    filepath,
+    change_year_interval=None,
+    inclusive_stop=True,
+    cache=None,
+    loader=read_change_records,
+    verbose=1,
+):
+    """Returns interval data for a change records file, using the cache
+
+    On a cache hit the stored dataframe is returned without reading the
+    change records. On a miss, the records are read with ``loader``, the
+    interval data is generated with the single-pass engine of
+    :func:`caproj.datagen.generate_interval_data` and the result is cached.
+
+    :param filepath: string path of the cleaned change records file
+    :param change_year_interval: integer or None, as passed to
+                                 generate_interval_data() (default None)
+    :param inclusive_stop: boolean, as passed to generate_interval_data()
+                           (default True)
+    :param cache: IntervalCache object or None, if None an IntervalCache with
+                  the default settings is used (default cache=None)
+    :param loader: function reading filepath into a pd.DataFrame (default
+                   loader=caproj.datagen.read_change_records)
+    :param verbose: integer, default verbose=1 prints whether the result was
+                    read from the cache, otherwise nothing is printed
+
+    :return: pd.DataFrame containing the summary change data for each unique
+             project matching the specified change_year_interval
+    """
+    if cache is None:
+        cache = IntervalCache()
+
+    key = cache.key(filepath, change_year_interval, inclusive_stop)
+    df = cache.get(key)
+    cache_hit = df is not None
+
+    if not cache_hit:
+        df = generate_interval_data(
+            loader(filepath),
+            change_year_interval=change_year_interval,
+            inclusive_stop=inclusive_stop,
+            verbose=0,
+            engine="single_pass",
+        )
+        cache.put(key, df)
+
+    if verbose == 1:
+        print(
+            "The interval dataframe was {} the cache at:\n\n\t{}\n".format(
+                "read from" if cache_hit else "stored in",
+                cache._path(key),
+            )
+        )
+
+    return df
@@ -30,22 +30,61 @@ cause problems: the code will get executed twice:
 """
 import argparse
 
+from .datagen import interval_file_formats
+from .ingest import ingest_change_records
 
-parser = argparse.ArgumentParser(description="Command description.")
-parser.add_argument(
-    "names",
-    metavar="NAME",
-    nargs=argparse.ZERO_OR_MORE,
-    help="A name of something.",
+
+parser = argparse.ArgumentParser(
+    description="Command line tools for the NYC capital projects data."
+)
+subparsers = parser.add_subparsers(dest="command")
+
+ingest_parser = subparsers.add_parser(
+    "ingest",
+    help="Convert the raw change records .csv into the cleaned change records.",
+)
+ingest_parser.add_argument(
+    "filepath", help="Path of the raw NYC capital projects .csv file."
+)
+ingest_parser.add_argument(
+    "save_path", help="Path to which the cleaned change records are saved."
+)
+ingest_parser.add_argument(
+    "--format",
+    dest="file_format",
+    choices=interval_file_formats,
+    default="csv",
+    help="File format of the saved change records (default: csv).",
+)
+ingest_parser.add_argument(
+    "--compiled-date",
+    default=None,
+    help="Date the dataset was compiled (default: latest reported date).",
+)
+ingest_parser.add_argument(
+    "--chunksize",
+    type=int,
+    default=100000,
+    help="Number of rows read per chunk (default: 100000).",
 )
 
 
 def main(args=None):
-    """Placeholder function for testing and to illustrate cli
+    """Runs the ``caproj`` command line app
 
-    Prints list of input arguments
+    Prints the usage help if no command is specified
 
-    :param args: ``str`` or ``NoneType``, default is ``None``
+    :param args: ``list`` of ``str`` or ``NoneType``, default is ``None``
     """
     args = parser.parse_args(args=args)
-    print(args.names)
+
+    if args.command == "ingest":
+        ingest_change_records(
+            args.filepath,
+            save_path=args.save_path,
+            file_format=args.file_format,
+            compiled_date=args.compiled_date,
+            chunksize=args.chunksize,
+        )
+    else:
+        parser.print_help()
@@ -41,6 +41,7 @@ from sklearn.cluster import DBSCAN
 from sklearn.neighbors import NearestNeighbors
 from sklearn.metrics import silhouette_samples, silhouette_score
 
+from .scale import CategoryEncoder
 from .visualize import plot_value_counts
 
 
@@ -532,6 +533,11 @@ class UMAP_embedder:
             0. mapping
             1. columns needed to be added to harmonize with entire data
             2. dummified df before adding columns of [1]
+
+        The one-hot encoding used for the mapping comes from a
+        ``caproj.scale.CategoryEncoder`` whose vocabulary is read from
+        final_cols once and reused on later calls. Objects 1 and 2 are only
+        computed, with ``pd.get_dummies``, if return_extra=True.
         """
         df_to_transform = df[self.scale_cols]  # .drop(columns=["PID"])
         transformed_columns = pd.DataFrame(
@@ -541,13 +547,22 @@ class UMAP_embedder:
         scaled_df = (
             df[df.columns.difference(transformed_columns.columns)]
         ).join(transformed_columns)
-        dummified = pd.get_dummies(scaled_df[self.cols_to_dummify])
-
-        added_cols = set(self.final_cols) - set(dummified.columns)
-        added_cols = {col: 0 for col in added_cols}
+        dummify_df = scaled_df[self.cols_to_dummify]
+
+        # numeric columns pass through, as with pd.get_dummies
+        passthrough_cols = list(dummify_df.select_dtypes("number").columns)
+        encoder = getattr(self, "_category_encoder", None)
+        if encoder is None:
+            encoder = CategoryEncoder.from_feature_names(
+                self.final_cols,
+                dummify_df.columns.difference(passthrough_cols, sort=False),
+            )
+            self._category_encoder = encoder
 
-        dummified_full = dummified.assign(**added_cols)
-        dummified_full = dummified_full[self.final_cols]
+        encoded = encoder.transform(dummify_df)
+        dummified_full = pd.concat(
+            [dummify_df[passthrough_cols], encoded], axis=1
+        ).reindex(columns=self.final_cols, fill_value=0)
         mapping_df_list = []
         mapper_list = (
             self.mapper_dict["attributes"].values()
@@ -573,6 +588,10 @@ class UMAP_embedder:
         final_df["PID"] = scaled_df["PID"]
 
         if return_extra:
+            dummified = pd.get_dummies(dummify_df)
+            added_cols = set(self.final_cols) - set(dummified.columns)
+            added_cols = {col: 0 for col in added_cols}
+
             return final_df, added_cols, scaled_df, dummified
         else:
             return final_df
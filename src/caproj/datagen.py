@@ -9,24 +9,125 @@ for each unique capital project
 
 .. autosummary::
 
+   datetime_columns
+   categorical_columns
+   text_columns
+   change_record_dtypes
+   interval_datetime_columns
+   interval_file_formats
+   interval_backends
+   change_feature_columns
+   day_feature_columns
    endstate_columns
    endstate_column_rename_dict
    info_columns
    info_column_rename_dict
 
+**Module classes:**
+
+.. autosummary::
+
+   IntervalPlan
+   IntervalStateStore
+   ProjectIndex
+   AsOfIndex
+
 **Module functions:**
 
 .. autosummary::
 
    print_record_project_count
+   years_since
+   find_max_record_positions
+   compute_change_features
+   build_interval_data
+   build_interval_data_sharded
    generate_interval_data
+   generate_interval_batch
+   apply_dtype_schema
+   iter_change_records
+   read_change_records
+   stream_interval_data
+   save_interval_data
+   load_interval_data
    print_interval_dict
 
 """
 
+import multiprocessing
 import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
+import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
+
+#: List of column names containing datetime values in the change records data
+datetime_columns = [
+    "Date_Reported_As_Of",
+    "Design_Start",
+    "Original_Schedule",
+    "Forecast_Completion",
+]
+
+#: List of column names containing datetime values in the interval data
+interval_datetime_columns = [
+    "Design_Start",
+    "Schedule_Start",
+    "Final_Change_Date",
+    "Schedule_End",
+]
+
+#: List of file formats accepted for saving interval data to disk
+interval_file_formats = ["csv", "parquet", "feather"]
+
+#: List of dataframe backends accepted for generating interval data
+interval_backends = ["pandas", "polars"]
+
+#: List of repeated, low-cardinality text columns read as categoricals
+categorical_columns = [
+    "Category",
+    "Borough",
+    "Managing_Agency",
+    "Client_Agency",
+    "Current_Phase",
+]
+
+#: List of long text columns repeated on every change record of a project
+text_columns = ["Project_Name", "Description"]
+
+#: Dictionary of memory-compact dtypes for the cleaned change records data
+change_record_dtypes = {
+    **{col: "category" for col in categorical_columns},
+    "PID": "int32",
+    "PID_Index": "int16",
+    "Change_Year": "int8",
+    "Change_Years": "float32",
+    "Current_Project_Year": "int8",
+    "Current_Project_Years": "float32",
+    "Latest_Schedule_Changes": "float32",
+    "Total_Schedule_Changes": "float32",
+}
+
+#: List of the interval change metric columns added by add_change_features()
+change_feature_columns = [
+    "Duration_Start",
+    "Duration_End",
+    "Schedule_Change",
+    "Budget_Change",
+    "Schedule_Change_Ratio",
+    "Budget_Change_Ratio",
+    "Budget_Abs_Per_Error",
+    "Budget_Rel_Per_Error",
+    "Duration_End_Ratio",
+    "Budget_End_Ratio",
+    "Duration_Ratio_Inv",
+    "Budget_Ratio_Inv",
+]
+
+#: List of the change_feature_columns measured in whole days
+day_feature_columns = ["Duration_Start", "Duration_End", "Schedule_Change"]
 
 #: List of column names containing info for each project's end-state
 endstate_columns = [
@@ -125,14 +226,7 @@ def ensure_datetime_and_sort(df):
     :return: Original pd.DataFrame with datetime columns formatted and records
              sorted
     """
-    datetime_cols = [
-        "Date_Reported_As_Of",
-        "Design_Start",
-        "Original_Schedule",
-        "Forecast_Completion",
-    ]
-
-    for col in datetime_cols:
+    for col in datetime_columns:
         df[col] = pd.to_datetime(df[col])
 
     # make sure data is sorted properly
@@ -141,6 +235,31 @@ def ensure_datetime_and_sort(df):
     return df
 
 
+def years_since(start_dates, end_dates):
+    """Returns the decimal and integer years between two sets of dates
+
+    This is how the ``Change_Years``, ``Change_Year``,
+    ``Current_Project_Years`` and ``Current_Project_Year`` columns of the
+    cleaned change records are derived from ``Design_Start``. Decimal years
+    are whole days divided by 365, and integer years are the project year in
+    which the end date falls (i.e. rounded up, so that dates in a project's
+    first year are in year 1).
+
+    :param start_dates: array-like of datetime-like start dates
+    :param end_dates: array-like of datetime-like end dates, or a single
+                      datetime-like end date
+
+    :return: tuple of np.ndarrays of the decimal years and integer years
+    """
+    days = (
+        np.asarray(pd.to_datetime(end_dates), dtype="datetime64[ns]")
+        - np.asarray(pd.to_datetime(start_dates), dtype="datetime64[ns]")
+    ) // np.timedelta64(1, "D")
+    years = days / 365
+
+    return years, np.ceil(years).astype(int)
+
+
 def extract_project_details(
     df,
     copy_columns=info_columns,
@@ -219,6 +338,77 @@ def subset_project_changes(
     return df_subset.set_index("Record_ID")
 
 
+def _concat_records(frames, **kwargs):
+    """Concatenates dataframes, taking the union of any categorical dtypes"""
+    df = pd.concat(frames, **kwargs)
+
+    for col in frames[0].select_dtypes("category").columns:
+        if not pd.api.types.is_categorical_dtype(df[col]):
+            df[col] = union_categoricals(
+                [frame[col] for frame in frames], sort_categories=True
+            )
+
+    return df
+
+
+def _sort_record_positions(df, record_index="PID_Index"):
+    """Returns the integer positions that sort records by PID and record_index"""
+    return np.lexsort((df[record_index].values, df["PID"].values))
+
+
+def _interval_record_mask(
+    df,
+    change_year_interval,
+    change_col="Change_Year",
+    project_age_col="Current_Project_Year",
+    inclusive_stop=True,
+):
+    """Returns a boolean array of the records kept by subset_project_changes()"""
+    ages = df[project_age_col].values
+
+    return (df[change_col].values <= change_year_interval) & (
+        ages >= change_year_interval
+        if inclusive_stop
+        else ages > change_year_interval
+    )
+
+
+def _last_record_positions(df, order, mask=None):
+    """Returns the last of the PID-ordered positions for each PID in the mask"""
+    if mask is not None:
+        order = order[np.asarray(mask)[order]]
+
+    pids = df["PID"].values[order]
+    is_last = np.ones(len(order), dtype=bool)
+    is_last[:-1] = pids[1:] != pids[:-1]
+
+    return order[is_last]
+
+
+def find_max_record_positions(df, record_index="PID_Index", mask=None):
+    """Creates an array of integer positions of the max record for each PID
+
+    This is the integer-keyed counterpart to ``find_max_record_indices()``.
+    Records are ordered by PID and record_index with a single sort and the
+    last record of each PID is found at the boundaries of that ordering, so
+    no ``Record_ID`` strings are constructed or looked up.
+
+    :param df: pd.DataFrame containing the cleaned capital project change
+               records
+    :param record_index: string name of column containing PID ordinal
+                         indices (default record_index='PID_Index')
+    :param mask: optional boolean array of the same length as df, if provided
+                 only records where mask is True are considered (default
+                 mask=None)
+
+    :return: np.ndarray of integer positions into df, ordered by PID, for use
+             with ``df.iloc``
+    """
+    return _last_record_positions(
+        df, _sort_record_positions(df, record_index), mask
+    )
+
+
 def find_max_record_indices(df, record_index="PID_Index"):
     """Creates a list of Record_ID values of the max record ID for each PID
 
@@ -282,19 +472,15 @@ def project_interval_endstate(
              the index is set to the PID
     """
     if change_year_interval:
-        df = subset_project_changes(
-            df.copy(),
-            change_year_interval,
-            change_col,
-            project_age_col,
-            inclusive_stop,
+        mask = _interval_record_mask(
+            df, change_year_interval, change_col, project_age_col, inclusive_stop,
         )
     else:
-        df = df.copy().set_index("Record_ID")
+        mask = None
 
-    max_record_list = find_max_record_indices(df, record_index)
+    max_record_positions = find_max_record_positions(df, record_index, mask)
 
-    df_endstate = df.copy().loc[max_record_list][keep_columns]
+    df_endstate = df.iloc[max_record_positions][keep_columns]
 
     if column_rename_dict:
         df_endstate = df_endstate.copy().rename(columns=column_rename_dict)
@@ -321,64 +507,769 @@ def join_data_endstate(df_details, df_endstate, how="inner"):
     return df_join.reset_index()
 
 
-def add_change_features(df):
+def _divide(numerator, denominator, out, zero_division=None):
+    """Divides arrays into out, assigning zero_division where denominator is 0
+
+    Missing numerators stay nan. Returns the boolean array of the positions
+    assigned zero_division, or None if zero_division is None.
+    """
+    if zero_division is None:
+        np.divide(numerator, denominator, out=out)
+        return None
+
+    is_zero = (denominator == 0) & ~np.isnan(numerator)
+    np.divide(numerator, denominator, out=out, where=~is_zero)
+    out[is_zero] = zero_division
+
+    return is_zero
+
+
+def compute_change_features(
+    design_start,
+    schedule_start,
+    schedule_end,
+    budget_start,
+    budget_end,
+    zero_division=None,
+    out=None,
+):
+    """Computes all interval change metrics into a single 2D float array
+
+    Each metric is written directly into its column of one preallocated
+    array, with no intermediate pandas Series or index alignment. The
+    columns are ordered as in the ``change_feature_columns`` module variable.
+
+    Division by zero follows IEEE arithmetic by default, as in pandas: a
+    non-zero value divided by zero is ``inf`` (or ``-inf``) and zero divided
+    by zero is ``nan``. Missing inputs (``NaT`` or ``nan``) always result in
+    ``nan``, including where zero_division is provided.
+
+    :param design_start: array-like of Design_Start datetimes
+    :param schedule_start: array-like of Schedule_Start datetimes
+    :param schedule_end: array-like of Schedule_End datetimes
+    :param budget_start: array-like of Budget_Start values
+    :param budget_end: array-like of Budget_End values
+    :param zero_division: None or float, if a float is provided, any ratio
+                          metric whose denominator is zero is set to this
+                          value instead of ``inf`` or ``nan`` (default
+                          zero_division=None)
+    :param out: optional preallocated float64 array of shape
+                ``(n, len(change_feature_columns))`` into which the metrics
+                are written (default out=None)
+
+    :return: np.ndarray of shape ``(n, len(change_feature_columns))``
+    """
+    design_start = np.asarray(design_start, dtype="datetime64[ns]")
+    schedule_start = np.asarray(schedule_start, dtype="datetime64[ns]")
+    schedule_end = np.asarray(schedule_end, dtype="datetime64[ns]")
+    budget_start = np.asarray(budget_start, dtype=np.float64)
+    budget_end = np.asarray(budget_end, dtype=np.float64)
+
+    if out is None:
+        out = np.empty(
+            (len(budget_start), len(change_feature_columns)), order="F"
+        )
+
+    (
+        duration_start,
+        duration_end,
+        schedule_change,
+        budget_change,
+        schedule_change_ratio,
+        budget_change_ratio,
+        budget_abs_per_error,
+        budget_rel_per_error,
+        duration_end_ratio,
+        budget_end_ratio,
+        duration_ratio_inv,
+        budget_ratio_inv,
+    ) = out.T
+
+    # durations in whole days, floored as with the pandas ``.dt.days``
+    one_day = np.timedelta64(1, "D")
+    np.floor((schedule_start - design_start) / one_day, out=duration_start)
+    np.floor((schedule_end - design_start) / one_day, out=duration_end)
+    np.subtract(duration_end, duration_start, out=schedule_change)
+    np.subtract(budget_end, budget_start, out=budget_change)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        _divide(
+            schedule_change,
+            duration_start,
+            schedule_change_ratio,
+            zero_division,
+        )
+        _divide(budget_change, budget_start, budget_change_ratio, zero_division)
+
+        np.abs(budget_change, out=budget_abs_per_error)
+        budget_rel_per_error[:] = budget_abs_per_error
+        _divide(
+            budget_abs_per_error, budget_end, budget_abs_per_error, zero_division
+        )
+        _divide(
+            budget_rel_per_error,
+            budget_start,
+            budget_rel_per_error,
+            zero_division,
+        )
+
+        _divide(duration_end, duration_start, duration_end_ratio, zero_division)
+        _divide(budget_end, budget_start, budget_end_ratio, zero_division)
+
+        duration_filled = _divide(
+            duration_start, duration_end, duration_ratio_inv, zero_division
+        )
+        budget_filled = _divide(
+            budget_start, budget_end, budget_ratio_inv, zero_division
+        )
+
+    # the inverse ratios are offset by 1, except where zero_division was used
+    for ratio_inv, filled in [
+        (duration_ratio_inv, duration_filled),
+        (budget_ratio_inv, budget_filled),
+    ]:
+        np.subtract(
+            ratio_inv,
+            1,
+            out=ratio_inv,
+            where=True if filled is None else ~filled,
+        )
+
+    return out
+
+
+def add_change_features(df, copy=True, zero_division=None):
     """Calculates interval change metrics for each PID and appends the dataset
 
+    The metrics are computed together by ``compute_change_features()``.
+    The day-count columns (Duration_Start, Duration_End and Schedule_Change)
+    are integers unless they contain missing values.
+
     :param df: pd.DataFrame containing joined project interval data output
                from the join_data_endstate() function
+    :param copy: boolean, if False the new metrics are appended to the input
+                 dataframe itself rather than to a copy of it (default
+                 copy=True)
+    :param zero_division: None or float, passed to compute_change_features(),
+                          if None ratios with a zero denominator are ``inf``
+                          or ``nan`` (default zero_division=None)
 
     :return: Copy of input pd.DataFrame with the new metrics appended as
-             additional columns
+             additional columns, or the input pd.DataFrame if copy=False
     """
     # copy input for comparison of outputs
-    df_copy = df.copy()
-
-    # calculate interval change features
-    df_copy["Duration_Start"] = (
-        df_copy["Schedule_Start"] - df_copy["Design_Start"]
-    ).dt.days
-    df_copy["Duration_End"] = (
-        df_copy["Schedule_End"] - df_copy["Design_Start"]
-    ).dt.days
-    df_copy["Schedule_Change"] = (
-        df_copy["Duration_End"] - df_copy["Duration_Start"]
+    df_copy = df.copy() if copy else df
+
+    feature_block = compute_change_features(
+        df_copy["Design_Start"].values,
+        df_copy["Schedule_Start"].values,
+        df_copy["Schedule_End"].values,
+        df_copy["Budget_Start"].values,
+        df_copy["Budget_End"].values,
+        zero_division=zero_division,
     )
-    df_copy["Budget_Change"] = df_copy["Budget_End"] - df_copy["Budget_Start"]
 
-    # define schedule change ratio
-    df_copy["Schedule_Change_Ratio"] = (
-        df_copy["Schedule_Change"] / df_copy["Duration_Start"]
+    for i, col in enumerate(change_feature_columns):
+        values = feature_block[:, i]
+        if col in day_feature_columns and not np.isnan(values).any():
+            values = values.astype(np.int64)
+        df_copy[col] = values
+
+    return df_copy
+
+
+def _gather_records(df, positions, columns, column_rename_dict=None):
+    """Gathers the rows at integer positions for the specified columns
+
+    Datetime columns are parsed on the gathered rows only, and the resulting
+    dataframe is indexed by PID to match the stepwise helper functions.
+    """
+    column_rename_dict = column_rename_dict or {}
+    gathered = {}
+
+    for col in columns:
+        values = df[col].iloc[positions]
+        if col in datetime_columns:
+            values = pd.to_datetime(values)
+        gathered[column_rename_dict.get(col, col)] = values.values
+
+    return pd.DataFrame(gathered).set_index("PID")
+
+
+def _join_gathered_records(df_details, df_endstate, features=True):
+    """Inner joins PID-ordered details and endstate records, adding features"""
+    _, detail_idx, endstate_idx = np.intersect1d(
+        df_details.index.values, df_endstate.index.values, return_indices=True
     )
-    # define budget change ratio
-    df_copy["Budget_Change_Ratio"] = (
-        df_copy["Budget_Change"] / df_copy["Budget_Start"]
+
+    df_merged = pd.concat(
+        [df_details.iloc[detail_idx], df_endstate.iloc[endstate_idx]], axis=1
+    ).reset_index()
+
+    if not features:
+        return df_merged
+
+    return add_change_features(df_merged, copy=False)
+
+
+def build_interval_data(
+    data,
+    change_year_interval=None,
+    inclusive_stop=True,
+    record_index="PID_Index",
+    change_col="Change_Year",
+    project_age_col="Current_Project_Year",
+    use_record=0,
+    backend="pandas",
+):
+    """Generates the project interval dataset in a single sorted pass
+
+    This is the ``engine="single_pass"`` counterpart to chaining
+    ``ensure_datetime_and_sort()``, ``project_interval_endstate()``,
+    ``extract_project_details()``, ``join_data_endstate()`` and
+    ``add_change_features()``, each of which copies the full change records
+    table. Here the records are sorted once as an array of integer positions,
+    the first and last qualifying record for each PID are located from that
+    ordering, and only those rows are gathered from the input dataframe. The
+    input dataframe is neither modified nor copied. If data is a
+    ``ProjectIndex``, its records are already sorted and the sort is skipped.
+
+    :param data: pd.DataFrame of the cleaned capital projects change
+                 records data, or a ProjectIndex of those records ordered by
+                 record_index
+    :param change_year_interval: integer or None representing the maximum year
+                                 from which to include changes for each
+                                 project,  if None, then all years' worth of
+                                 changes included (default
+                                 change_year_interval=None)
+    :param inclusive_stop: boolean, indicating whether projects to be included
+                           need to be older than the change_year_interval year
+                           (False) or can be equal-to-or-older-than the
+                           change_year_interval year (True) (default
+                           inclusive_stop=True)
+    :param record_index: string name of column containing PID ordinal
+                         indices (default record_index='PID_Index')
+    :param change_col: string, name of column containing change year indicators
+                       (default change_col='Change_Year')
+    :param project_age_col: string, name of column containing current age of
+                            each project at the time the dataset was compiled
+                            (default project_age_col='Current_Project_Year')
+    :param use_record: integer record_index value of the record used for each
+                       project's details (default use_record=0)
+    :param backend: string, one of 'pandas' or 'polars', the dataframe library
+                    used to locate each project's details and endstate
+                    records. With 'polars' (an optional dependency), the
+                    group-by and join run multithreaded on the PID and
+                    record_index columns only, while the records themselves
+                    are gathered from data as with 'pandas', so both backends
+                    return identical output (default backend='pandas')
+
+    :return: pd.DataFrame containing the summary change data for each unique
+             project, identical to the output of the stepwise engine
+    """
+    if backend not in interval_backends:
+        raise ValueError(
+            "backend only accepts {}, but you have entered: {}"
+            "".format(interval_backends, backend)
+        )
+
+    if isinstance(data, ProjectIndex):
+        if data.date_col is not None or data.record_index != record_index:
+            raise ValueError(
+                "build_interval_data only accepts a ProjectIndex ordered by "
+                "record_index '{}', but you have entered one ordered by: "
+                "{}".format(
+                    record_index, data.date_col or data.record_index
+                )
+            )
+        data = data.data
+        order = np.arange(len(data))
+    elif backend == "pandas":
+        order = _sort_record_positions(data, record_index)
+
+    # endstate is the last record of each PID within the interval
+    if change_year_interval:
+        mask = _interval_record_mask(
+            data,
+            change_year_interval,
+            change_col,
+            project_age_col,
+            inclusive_stop,
+        )
+    else:
+        mask = None
+
+    if backend == "polars":
+        detail_positions, endstate_positions = _polars_record_positions(
+            data, mask, record_index, use_record
+        )
+    else:
+        # project details are taken from the use_record record of each PID
+        detail_positions = order[data[record_index].values[order] == use_record]
+        endstate_positions = _last_record_positions(data, order, mask)
+
+    df_details = _gather_records(
+        data, detail_positions, info_columns, info_column_rename_dict,
+    )
+    df_endstate = _gather_records(
+        data, endstate_positions, endstate_columns, endstate_column_rename_dict,
     )
 
-    # define project metrics
-    df_copy["Budget_Abs_Per_Error"] = (
-        df_copy["Budget_Start"] - df_copy["Budget_End"]
-    ).abs() / df_copy["Budget_End"]
+    return _join_gathered_records(df_details, df_endstate)
 
-    df_copy["Budget_Rel_Per_Error"] = (
-        df_copy["Budget_Start"] - df_copy["Budget_End"]
-    ).abs() / df_copy["Budget_Start"]
 
-    df_copy["Duration_End_Ratio"] = (
-        df_copy["Duration_End"] / df_copy["Duration_Start"]
+def _import_polars():
+    """Imports polars, which is only required for backend='polars'"""
+    try:
+        import polars
+    except ImportError:
+        raise ImportError(
+            "backend='polars' requires the polars package, which can be "
+            "installed with: pip install polars"
+        )
+
+    return polars
+
+
+def _polars_record_positions(data, mask, record_index, use_record):
+    """Locates the details and endstate record positions with polars
+
+    Only the PID and record_index columns (and the interval mask) are handed
+    to polars, whose multithreaded group-by and join return the positions of
+    each PID's use_record record and last masked record, ordered by PID.
+    """
+    pl = _import_polars()
+
+    n_records = len(data)
+    records = pl.DataFrame(
+        {
+            "PID": data["PID"].values,
+            "record": data[record_index].values,
+            "position": np.arange(n_records),
+            "mask": np.ones(n_records, dtype=bool) if mask is None else mask,
+        }
     )
-    df_copy["Budget_End_Ratio"] = (
-        df_copy["Budget_End"] / df_copy["Budget_Start"]
+
+    # ties are broken by position, as in the stable sort of the pandas backend
+    details = (
+        records.filter(pl.col("record") == use_record)
+        .group_by("PID")
+        .agg(pl.col("position").min().alias("details"))
     )
+    endstate = (
+        records.filter(pl.col("mask"))
+        .group_by("PID")
+        .agg(
+            pl.col("position")
+            .sort_by(["record", "position"])
+            .last()
+            .alias("endstate")
+        )
+    )
+    positions = details.join(endstate, on="PID", how="inner").sort("PID")
 
-    # previously titled 'Mark Metric'
-    df_copy["Duration_Ratio_Inv"] = (
-        df_copy["Duration_Start"] / df_copy["Duration_End"]
-    ) - 1
-    df_copy["Budget_Ratio_Inv"] = (
-        df_copy["Budget_Start"] / df_copy["Budget_End"]
-    ) - 1
+    return (
+        positions["details"].to_numpy(),
+        positions["endstate"].to_numpy(),
+    )
 
-    return df_copy
+
+def _shard_positions(data, shard_by="PID", n_shards=None):
+    """Returns a list of integer position arrays, one per non-empty shard
+
+    All records of a PID are assigned to the same shard, either by hashing
+    the PID or by the Managing_Agency of each PID's first record.
+    """
+    pids = data["PID"].values
+
+    if shard_by == "PID":
+        shard_ids = pd.util.hash_array(pids) % np.uint64(n_shards)
+    else:
+        order = _sort_record_positions(data)
+        is_first = np.ones(len(order), dtype=bool)
+        is_first[1:] = pids[order][1:] != pids[order][:-1]
+        first_positions = order[is_first]
+        agency_codes = pd.factorize(data[shard_by].values[first_positions])[0]
+        shard_ids = (
+            pd.Series(agency_codes, index=pids[first_positions])
+            .reindex(pids)
+            .values
+        )
+
+    shard_ids = np.asarray(shard_ids, dtype=np.int64)
+    order = np.argsort(shard_ids, kind="stable")
+    boundaries = np.flatnonzero(np.diff(shard_ids[order])) + 1
+
+    return [
+        positions
+        for positions in np.split(order, boundaries)
+        if len(positions)
+    ]
+
+
+def build_interval_data_sharded(
+    data,
+    change_year_interval=None,
+    inclusive_stop=True,
+    n_jobs=None,
+    shard_by="PID",
+    n_shards=None,
+    backend="pandas",
+):
+    """Generates the project interval dataset on shards across processes
+
+    The change records are partitioned so that all of a project's records
+    fall in the same shard, ``build_interval_data()`` is run on each shard in
+    a process pool, and the shard results are concatenated in PID order. The
+    output is therefore identical to that of ``build_interval_data()`` on
+    the full dataset, regardless of the number of shards or workers.
+
+    :param data: pd.DataFrame of the cleaned capital projects change
+                 records data
+    :param change_year_interval: integer or None representing the maximum year
+                                 from which to include changes for each
+                                 project,  if None, then all years' worth of
+                                 changes included (default
+                                 change_year_interval=None)
+    :param inclusive_stop: boolean, passed through to build_interval_data()
+                           (default inclusive_stop=True)
+    :param n_jobs: integer or None, number of worker processes, if None or -1
+                   all available cores are used (default n_jobs=None)
+    :param shard_by: string, either 'PID' to partition projects by a hash of
+                     their PID, or 'Managing_Agency' to partition projects by
+                     the managing agency of their first record (default
+                     shard_by='PID')
+    :param n_shards: integer or None, number of PID hash shards, if None one
+                     shard per worker is used, ignored if shard_by is
+                     'Managing_Agency' (default n_shards=None)
+    :param backend: string, passed through to build_interval_data() (default
+                    backend='pandas')
+
+    :return: pd.DataFrame containing the summary change data for each unique
+             project, identical to the output of build_interval_data()
+    """
+    if shard_by not in ["PID", "Managing_Agency"]:
+        raise ValueError(
+            "shard_by only accepts 'PID' or 'Managing_Agency', "
+            "but you have entered: {}".format(shard_by)
+        )
+
+    if n_jobs is None or n_jobs == -1:
+        n_jobs = os.cpu_count()
+
+    shards = [
+        data.iloc[positions]
+        for positions in _shard_positions(data, shard_by, n_shards or n_jobs)
+    ]
+
+    # polars' thread pool does not survive a fork, so workers are spawned,
+    # mp_context is only passed then as it requires Python 3.7 or later
+    executor_kwargs = {}
+    if backend == "polars":
+        executor_kwargs["mp_context"] = multiprocessing.get_context("spawn")
+
+    with ProcessPoolExecutor(max_workers=n_jobs, **executor_kwargs) as executor:
+        results = list(
+            executor.map(
+                build_interval_data,
+                shards,
+                repeat(change_year_interval),
+                repeat(inclusive_stop),
+                repeat("PID_Index"),
+                repeat("Change_Year"),
+                repeat("Current_Project_Year"),
+                repeat(0),
+                repeat(backend),
+            )
+        )
+
+    df_features = _concat_records(results, ignore_index=True)
+
+    return df_features.iloc[
+        np.argsort(df_features["PID"].values, kind="stable")
+    ].reset_index(drop=True)
+
+
+class IntervalPlan:
+    """Lazily evaluated plan for generating project interval data
+
+    A plan records the source of the change records, the analysis interval
+    and the interval data columns requested, and nothing is read or computed
+    until ``collect()`` (or ``count()``) is called. The plan is composed with
+    ``interval()`` and ``select()``, each of which returns a new plan.
+
+    When the plan is executed, the requested columns are pushed back to the
+    source: only the change records columns needed to produce them are read
+    (with ``usecols`` if the source is a file) and gathered, and
+    ``add_change_features()`` is only run if a change metric is requested.
+    The collected output is identical to the matching columns of
+    ``build_interval_data()``.
+
+    :param source: pd.DataFrame of the cleaned capital projects change records
+                   data, a ProjectIndex of those records, or a string path of
+                   a cleaned change records .csv file
+    :param change_year_interval: integer or None representing the maximum year
+                                 from which to include changes for each
+                                 project,  if None, then all years' worth of
+                                 changes included (default
+                                 change_year_interval=None)
+    :param inclusive_stop: boolean, passed through to the interval subsetting
+                           as in ``build_interval_data()`` (default
+                           inclusive_stop=True)
+    :param columns: list of interval data column names to return, or None to
+                    return all columns (default columns=None)
+    """
+
+    #: Interval data columns produced from the details record of each PID
+    details_output = {
+        info_column_rename_dict.get(col, col): col
+        for col in info_columns
+        if col != "PID"
+    }
+
+    #: Interval data columns produced from the endstate record of each PID
+    endstate_output = {
+        endstate_column_rename_dict.get(col, col): col
+        for col in endstate_columns
+        if col != "PID"
+    }
+
+    #: Change records columns required to compute the change metrics
+    feature_inputs = {
+        "details": ["Design_Start", "Original_Schedule", "Original_Budget"],
+        "endstate": ["Forecast_Completion", "Budget_Forecast"],
+    }
+
+    #: All interval data columns, in the order of build_interval_data()
+    all_columns = (
+        ["PID"]
+        + list(details_output)
+        + list(endstate_output)
+        + change_feature_columns
+    )
+
+    def __init__(
+        self,
+        source,
+        change_year_interval=None,
+        inclusive_stop=True,
+        columns=None,
+    ):
+        self.source = source
+        self.change_year_interval = change_year_interval
+        self.inclusive_stop = inclusive_stop
+        self.columns = self._validate_columns(columns)
+
+    def _validate_columns(self, columns):
+        """Returns columns as a list, checking they are interval columns"""
+        if columns is None:
+            return None
+
+        if isinstance(columns, str):
+            columns = [columns]
+
+        unknown = [col for col in columns if col not in self.all_columns]
+        if unknown:
+            raise ValueError(
+                "columns only accepts interval data columns {}, but you have "
+                "entered: {}".format(self.all_columns, unknown)
+            )
+
+        return list(columns)
+
+    def interval(self, change_year_interval, inclusive_stop=True):
+        """Returns a new plan for a different analysis interval
+
+        :param change_year_interval: integer or None, as in the class
+                                     constructor
+        :param inclusive_stop: boolean, as in the class constructor (default
+                               inclusive_stop=True)
+
+        :return: IntervalPlan object
+        """
+        return IntervalPlan(
+            self.source, change_year_interval, inclusive_stop, self.columns
+        )
+
+    def select(self, columns):
+        """Returns a new plan restricted to a subset of the output columns
+
+        :param columns: list of interval data column names, which must be a
+                        subset of the current plan's output columns
+
+        :return: IntervalPlan object
+        """
+        columns = self._validate_columns(columns)
+        unavailable = [
+            col for col in columns if col not in self.output_columns
+        ]
+        if unavailable:
+            raise ValueError(
+                "select only accepts columns of the current plan {}, but you "
+                "have entered: {}".format(self.output_columns, unavailable)
+            )
+
+        return IntervalPlan(
+            self.source, self.change_year_interval, self.inclusive_stop, columns
+        )
+
+    @property
+    def output_columns(self):
+        """List of the interval data columns returned by ``collect()``"""
+        return self.all_columns if self.columns is None else self.columns
+
+    def _requirements(self):
+        """Returns the details and endstate columns to gather and whether the
+        change metrics are computed
+        """
+        output = self.output_columns
+        features = any(col in change_feature_columns for col in output)
+
+        details = [
+            source_col
+            for col, source_col in self.details_output.items()
+            if col in output
+            or (features and source_col in self.feature_inputs["details"])
+        ]
+        endstate = [
+            source_col
+            for col, source_col in self.endstate_output.items()
+            if col in output
+            or (features and source_col in self.feature_inputs["endstate"])
+        ]
+
+        return details, endstate, features
+
+    def source_columns(self):
+        """Returns the change records columns read from the source
+
+        :return: list of column names
+        """
+        details, endstate, _ = self._requirements()
+        columns = self._interval_columns()
+
+        for col in details + endstate:
+            if col not in columns:
+                columns.append(col)
+
+        return columns
+
+    def _interval_columns(self):
+        """Returns the change records columns used to subset the interval"""
+        columns = ["PID", "PID_Index"]
+
+        if self.change_year_interval:
+            columns += ["Change_Year", "Current_Project_Year"]
+
+        return columns
+
+    def explain(self):
+        """Returns a description of the steps the plan executes
+
+        :return: string, one line per step
+        """
+        details, endstate, features = self._requirements()
+
+        if self.change_year_interval:
+            interval_filter = (
+                "Change_Year <= {0}, Current_Project_Year {1} {0}".format(
+                    self.change_year_interval,
+                    ">=" if self.inclusive_stop else ">",
+                )
+            )
+        else:
+            interval_filter = "none"
+
+        return "\n".join(
+            [
+                "read: {}".format(self.source_columns()),
+                "filter: {}".format(interval_filter),
+                "details: {}".format(details),
+                "endstate: {}".format(endstate),
+                "change features: {}".format(features),
+                "select: {}".format(self.output_columns),
+            ]
+        )
+
+    def _read(self, columns=None):
+        """Returns the source records and their PID-ordered positions
+
+        If the source is a file, only the specified columns are read, or the
+        ``source_columns()`` if columns is None.
+        """
+        if isinstance(self.source, ProjectIndex):
+            data = self.source.data
+            return data, np.arange(len(data))
+
+        if isinstance(self.source, str):
+            usecols = set(columns or self.source_columns())
+            data = read_change_records(
+                self.source,
+                usecols=lambda col: col.replace(" ", "_") in usecols,
+            )
+        else:
+            data = self.source
+
+        return data, _sort_record_positions(data)
+
+    def _endstate_positions(self, data, order):
+        """Returns the positions of each PID's last record in the interval"""
+        if self.change_year_interval:
+            mask = _interval_record_mask(
+                data,
+                self.change_year_interval,
+                inclusive_stop=self.inclusive_stop,
+            )
+        else:
+            mask = None
+
+        return _last_record_positions(data, order, mask)
+
+    def count(self):
+        """Returns the number of projects in the interval data
+
+        Only the PID, PID_Index and interval columns are read and used, and
+        no records are gathered.
+
+        :return: integer number of unique projects
+        """
+        data, order = self._read(self._interval_columns())
+        pids = data["PID"].values
+        detail_pids = pids[order[data["PID_Index"].values[order] == 0]]
+
+        return len(
+            np.intersect1d(
+                detail_pids, pids[self._endstate_positions(data, order)]
+            )
+        )
+
+    def collect(self):
+        """Executes the plan
+
+        :return: pd.DataFrame with the output_columns of the interval data
+                 for each unique project
+        """
+        details, endstate, features = self._requirements()
+        data, order = self._read()
+
+        df_details = _gather_records(
+            data,
+            order[data["PID_Index"].values[order] == 0],
+            ["PID"] + details,
+            info_column_rename_dict,
+        )
+        df_endstate = _gather_records(
+            data,
+            self._endstate_positions(data, order),
+            ["PID"] + endstate,
+            endstate_column_rename_dict,
+        )
+
+        df_features = _join_gathered_records(
+            df_details, df_endstate, features=features
+        )
+
+        return df_features[self.output_columns]
 
 
 def generate_interval_data(
@@ -390,6 +1281,11 @@ def generate_interval_data(
     custom_filename=None,
     verbose=1,
     return_df=True,
+    engine="stepwise",
+    file_format="csv",
+    n_jobs=None,
+    columns=None,
+    backend="pandas",
 ):
     """Generates a project analysis dataset for the specified interval
 
@@ -408,6 +1304,11 @@ def generate_interval_data(
         this ``to_csv`` behavior, however using them is not recommended
         for the sake of file naming consistency in this project.
 
+        Setting ``file_format`` to ``'parquet'`` or ``'feather'`` saves the
+        dataframe in that columnar format instead, with the matching file
+        extension. Those files preserve dtypes, including datetimes, and are
+        read back with ``load_interval_data()``.
+
     :param data: pd.DataFrame of the cleaned capital projects change
                  records data
     :param change_year_interval: integer or None representing the maximum year
@@ -436,29 +1337,93 @@ def generate_interval_data(
                     information is not printed
     :param return_df: boolean, determines whether the resulting pd.DataFrame
                       object is returned (default return_df=True)
+    :param engine: string, either 'stepwise' to chain the individual helper
+                   functions in this module, 'single_pass' to build the
+                   dataset with ``build_interval_data()``, which avoids
+                   copying the full change records table and is preferable
+                   for large datasets, or 'sharded' to run
+                   ``build_interval_data()`` on PID shards across a process
+                   pool with ``build_interval_data_sharded()``. All engines
+                   return the same output (default engine='stepwise')
+    :param file_format: string, one of 'csv', 'parquet' or 'feather',
+                        indicating the file format used if to_csv=True
+                        (default file_format='csv')
+    :param n_jobs: integer or None, number of worker processes used by the
+                   'sharded' engine, if None or -1 all available cores are
+                   used (default n_jobs=None)
+    :param columns: list of interval data column names or None, if provided
+                    the dataset is generated with an ``IntervalPlan`` that
+                    only reads and computes what those columns require, and
+                    engine is ignored (default columns=None)
+    :param backend: string, one of 'pandas' or 'polars', passed to
+                    ``build_interval_data()`` by the 'single_pass' and
+                    'sharded' engines, the 'stepwise' engine only supports
+                    'pandas' (default backend='pandas')
 
     :return: pd.DataFrame containing the summary change data for each unique
              project matching the specified change_year_interval
     """
-    data = ensure_datetime_and_sort(data.copy())
+    if file_format not in interval_file_formats:
+        raise ValueError(
+            "file_format only accepts {}, but you have entered: {}"
+            "".format(interval_file_formats, file_format)
+        )
+    if engine not in ["stepwise", "single_pass", "sharded"]:
+        raise ValueError(
+            "engine only accepts 'stepwise', 'single_pass' or 'sharded', "
+            "but you have entered: {}".format(engine)
+        )
+    if backend != "pandas" and engine == "stepwise":
+        raise ValueError(
+            "engine='stepwise' only accepts backend='pandas', "
+            "but you have entered: {}".format(backend)
+        )
 
-    df_endstate = project_interval_endstate(
-        data,
-        change_year_interval=change_year_interval,
-        inclusive_stop=inclusive_stop,
-    )
+    if columns is not None:
+        df_features = IntervalPlan(
+            data,
+            change_year_interval=change_year_interval,
+            inclusive_stop=inclusive_stop,
+            columns=columns,
+        ).collect()
+
+    elif engine == "single_pass":
+        df_features = build_interval_data(
+            data,
+            change_year_interval=change_year_interval,
+            inclusive_stop=inclusive_stop,
+            backend=backend,
+        )
+
+    elif engine == "sharded":
+        df_features = build_interval_data_sharded(
+            data,
+            change_year_interval=change_year_interval,
+            inclusive_stop=inclusive_stop,
+            n_jobs=n_jobs,
+            backend=backend,
+        )
+
+    else:
+        data = ensure_datetime_and_sort(data.copy())
+
+        df_endstate = project_interval_endstate(
+            data,
+            change_year_interval=change_year_interval,
+            inclusive_stop=inclusive_stop,
+        )
 
-    df_details = extract_project_details(data)
+        df_details = extract_project_details(data)
 
-    df_merged = join_data_endstate(df_details, df_endstate)
+        df_merged = join_data_endstate(df_details, df_endstate)
 
-    df_features = add_change_features(df_merged)
+        df_features = add_change_features(df_merged)
 
     if verbose == 1:
         # print numbeer of projects in the resulting dataframe
         print(
             "The number of unique projects in the resulting dataframe: {}\n"
-            "".format(df_features["PID"].nunique())
+            "".format(len(df_features))
         )
 
     if to_csv:
@@ -469,24 +1434,829 @@ def generate_interval_data(
             if change_year_interval:
                 save_path = os.path.join(
                     save_dir,
-                    "{}{}yr.csv".format(filename_base, change_year_interval),
+                    "{}{}yr.{}".format(
+                        filename_base, change_year_interval, file_format
+                    ),
                 )
             else:
                 save_path = os.path.join(
-                    save_dir, "{}all.csv".format(filename_base)
+                    save_dir, "{}all.{}".format(filename_base, file_format)
                 )
 
-        df_features.to_csv(save_path, index=False)
+        save_interval_data(df_features, save_path, file_format=file_format)
 
         print(
-            "The resulting interval features dataframe was saved to .csv at:"
-            "\n\n\t{}\n".format(save_path)
+            "The resulting interval features dataframe was saved to .{} at:"
+            "\n\n\t{}\n".format(file_format, save_path)
         )
 
     if return_df:
         return df_features
 
 
+def generate_interval_batch(
+    data,
+    change_year_intervals,
+    inclusive_stop=True,
+    long_format=False,
+    verbose=1,
+):
+    """Generates project analysis datasets for several intervals in one call
+
+    Equivalent to calling ``generate_interval_data()`` once for each interval,
+    but the records are sorted, the project details are extracted and the
+    datetime columns are parsed only once for the whole batch. Each interval's
+    endstate is then selected from the shared PID-ordered record positions.
+
+    :param data: pd.DataFrame of the cleaned capital projects change
+                 records data
+    :param change_year_intervals: list of integers (or None, indicating all
+                                  years' worth of changes) for which to
+                                  generate interval datasets, e.g.
+                                  ``[1, 2, 3, 5, 7, 10]``
+    :param inclusive_stop: boolean, indicating whether projects to be included
+                           need to be older than the change_year_interval year
+                           (False) or can be equal-to-or-older-than the
+                           change_year_interval year (True) (default
+                           inclusive_stop=True)
+    :param long_format: boolean, if True a single pd.DataFrame is returned with
+                        an additional ``interval`` column identifying the
+                        interval of each row, otherwise a dictionary is
+                        returned (default long_format=False)
+    :param verbose: integer, default verbose=1 prints the number of projects
+                    in each resulting dataframe, otherwise that information is
+                    not printed
+
+    :return: dict mapping each change_year_interval to its pd.DataFrame,
+             identical to the output of ``generate_interval_data()``, or a
+             single pd.DataFrame if long_format=True
+    """
+    order = _sort_record_positions(data)
+
+    df_details = _gather_records(
+        data,
+        order[data["PID_Index"].values[order] == 0],
+        info_columns,
+        info_column_rename_dict,
+    )
+
+    endstate_positions = {
+        interval: _last_record_positions(
+            data,
+            order,
+            _interval_record_mask(data, interval, inclusive_stop=inclusive_stop)
+            if interval
+            else None,
+        )
+        for interval in change_year_intervals
+    }
+
+    # gather the union of all endstate records once and slice per interval
+    all_positions = np.unique(np.concatenate(list(endstate_positions.values())))
+    df_endstate_all = _gather_records(
+        data, all_positions, endstate_columns, endstate_column_rename_dict
+    )
+
+    interval_dict = {}
+
+    for interval, positions in endstate_positions.items():
+        df_endstate = df_endstate_all.iloc[
+            np.searchsorted(all_positions, positions)
+        ]
+        interval_dict[interval] = _join_gathered_records(
+            df_details, df_endstate
+        )
+
+        if verbose == 1:
+            print(
+                "The number of unique projects in the {} interval dataframe: "
+                "{}\n".format(
+                    "{}yr".format(interval) if interval else "all",
+                    interval_dict[interval]["PID"].nunique(),
+                )
+            )
+
+    if long_format:
+        return pd.concat(
+            [
+                df.assign(interval=interval)
+                for interval, df in interval_dict.items()
+            ],
+            ignore_index=True,
+        )
+
+    return interval_dict
+
+
+class IntervalStateStore:
+    """Persisted per-PID interval state for incremental interval generation
+
+    The store keeps, for each PID, the details record (``PID_Index == 0``),
+    the PID_Index and date of its latest record, and the last record within
+    each interval's change years, along with the resulting interval
+    datasets. New change records (for instance, a newly published
+    ``Date_Reported_As_Of`` snapshot) are applied with ``update()``, which
+    only recomputes the endstate and ``add_change_features()`` columns of the
+    PIDs present in those records.
+
+    New records may come from a snapshot cleaned on its own (e.g. with
+    :func:`caproj.ingest.ingest_change_records`), in which case their
+    derived columns are made consistent with the stored history:
+
+    * the PID_Index values of records reported after a PID's latest stored
+      record are continued from that record's PID_Index, so that the
+      project's stored details (including its ``Original_Budget`` and
+      ``Original_Schedule``) are kept
+    * records of a stored PID are measured from the stored ``Design_Start``,
+      and their ``Change_Years`` and ``Change_Year`` are recomputed with
+      ``years_since()`` if their own Design_Start differs
+    * the compiled date of each update is read from its records'
+      ``Current_Project_Years``, and when it advances, the project ages of
+      all stored PIDs are recomputed and every PID's interval membership is
+      re-evaluated, which costs O(number of projects) rather than
+      O(number of change records)
+
+    Records are assumed to be append-only, i.e. a new snapshot adds records
+    rather than revising earlier ones, and records reported on or before a
+    PID's latest stored record are taken to come from the same full history
+    (for instance, chunks of one cleaned file) and are applied as they are.
+    Under these assumptions, ``interval_data()`` returns the same output as
+    running ``generate_interval_data()`` over the full history cleaned in one
+    pass. A snapshot reporting an earlier Design_Start than a stored PID's,
+    which would move all of that project's earlier change years, raises a
+    ValueError.
+
+    :param change_year_intervals: list of integers (or None, indicating all
+                                  years' worth of changes) for which interval
+                                  datasets are maintained
+    :param inclusive_stop: boolean, passed through to the interval subsetting
+                           as in ``generate_interval_data()`` (default
+                           inclusive_stop=True)
+    """
+
+    def __init__(self, change_year_intervals, inclusive_stop=True):
+        self.change_year_intervals = list(change_year_intervals)
+        self.inclusive_stop = inclusive_stop
+        self.details = None
+        self.latest = None
+        self.compiled_date = None
+        self.endstate = {interval: None for interval in self.change_year_intervals}
+        self.interval_dict = {
+            interval: None for interval in self.change_year_intervals
+        }
+
+    @staticmethod
+    def _upsert(df_old, df_new):
+        """Replaces or appends the PID-indexed rows of df_new in df_old"""
+        if df_old is None:
+            return df_new.sort_index()
+
+        return _concat_records(
+            [df_old.drop(df_new.index, errors="ignore"), df_new]
+        ).sort_index()
+
+    def _continue_history(self, data, dates, design_start):
+        """Returns data with its derived columns continued from the store"""
+        pids = data["PID"].values
+        stored = self.latest.reindex(pids)
+        stored_design_start = (
+            self.details["Design_Start"].reindex(pids).values
+            if self.details is not None
+            else np.full(len(pids), np.datetime64("NaT", "ns"))
+        )
+        known = stored["PID_Index"].notna().values & ~np.isnat(
+            stored_design_start
+        )
+        if not known.any():
+            return data
+
+        if (design_start[known] < stored_design_start[known]).any():
+            raise ValueError(
+                "IntervalStateStore.update() only accepts records with the "
+                "same or a later Design_Start than the stored PIDs, but you "
+                "have entered earlier Design_Start values for PIDs: {}".format(
+                    np.unique(
+                        pids[known][
+                            design_start[known] < stored_design_start[known]
+                        ]
+                    )
+                )
+            )
+
+        columns = {}
+
+        # continue the PID_Index of records reported after the stored ones
+        later = known & (dates > stored["Date_Reported_As_Of"].values)
+        if later.any():
+            later_positions = np.flatnonzero(later)
+            later_positions = later_positions[
+                np.lexsort(
+                    (
+                        data["PID_Index"].values[later_positions],
+                        dates[later_positions],
+                        pids[later_positions],
+                    )
+                )
+            ]
+            later_pids = pids[later_positions]
+            starts = np.flatnonzero(
+                np.r_[True, later_pids[1:] != later_pids[:-1]]
+            )
+            ranks = np.arange(len(later_positions)) - np.repeat(
+                starts, np.diff(np.r_[starts, len(later_positions)])
+            )
+
+            record_index = data["PID_Index"].values.copy()
+            record_index[later_positions] = np.maximum(
+                record_index[later_positions],
+                stored["PID_Index"].values[later_positions] + 1 + ranks,
+            )
+            columns["PID_Index"] = record_index.astype(
+                data["PID_Index"].dtype
+            )
+
+        # measure the records of stored PIDs from the stored Design_Start
+        moved = known & (design_start != stored_design_start)
+        if moved.any():
+            change_years, change_year = years_since(
+                stored_design_start[moved], dates[moved]
+            )
+            for col, moved_values in [
+                ("Design_Start", stored_design_start[moved]),
+                ("Change_Years", change_years),
+                ("Change_Year", change_year),
+            ]:
+                values = (
+                    design_start.copy()
+                    if col == "Design_Start"
+                    else data[col].values.copy()
+                )
+                values[moved] = moved_values
+                columns[col] = values
+
+        return data.assign(**columns) if columns else data
+
+    @staticmethod
+    def _compiled_dates(design_start, project_years):
+        """Returns the dates to which Current_Project_Years were measured"""
+        return np.asarray(design_start, dtype="datetime64[ns]") + np.round(
+            np.asarray(project_years, dtype=float) * 365
+        ).astype("timedelta64[D]")
+
+    def _update_project_ages(self, pids):
+        """Recomputes stale project ages of the given PIDs' details"""
+        details = self.details.loc[pids]
+        stale = self._compiled_dates(
+            details["Design_Start"].values,
+            details["Current_Project_Years"].values,
+        ) != np.datetime64(self.compiled_date, "ns")
+        if not stale.any():
+            return
+
+        details = details.loc[stale]
+        years, year = years_since(details["Design_Start"], self.compiled_date)
+
+        for col, values in [
+            ("Current_Project_Years", years),
+            ("Current_Project_Year", year),
+        ]:
+            self.details.loc[details.index, col] = values.astype(
+                self.details[col].dtype
+            )
+
+    def update(self, data):
+        """Applies new change records to the store and updates interval data
+
+        :param data: pd.DataFrame of cleaned capital projects change records,
+                     either the full history (to initialize the store), or
+                     only the records added since the last update, cleaned
+                     along with the full history or on their own
+
+        :return: dict mapping each change_year_interval to its updated
+                 pd.DataFrame of interval data
+        """
+        dates = pd.to_datetime(data["Date_Reported_As_Of"]).values
+        design_start = pd.to_datetime(data["Design_Start"]).values
+
+        if self.latest is not None:
+            data = self._continue_history(data, dates, design_start)
+            design_start = pd.to_datetime(data["Design_Start"]).values
+
+        order = _sort_record_positions(data)
+        updated_pids = np.unique(data["PID"].values)
+
+        compiled_date = self._compiled_dates(
+            design_start, data["Current_Project_Years"].values
+        ).max()
+        ages_advanced = (
+            self.compiled_date is not None
+            and compiled_date > self.compiled_date
+        )
+        if self.compiled_date is None or ages_advanced:
+            self.compiled_date = compiled_date
+
+        df_details = _gather_records(
+            data, order[data["PID_Index"].values[order] == 0], info_columns,
+        )
+        if len(df_details):
+            self.details = self._upsert(self.details, df_details)
+
+        last_positions = _last_record_positions(data, order)
+        df_latest = pd.DataFrame(
+            {
+                "PID_Index": data["PID_Index"].values[last_positions],
+                "Date_Reported_As_Of": dates[last_positions],
+            },
+            index=pd.Index(data["PID"].values[last_positions], name="PID"),
+        )
+        if self.latest is not None:
+            stored = self.latest.reindex(df_latest.index)
+            df_latest = df_latest.loc[
+                ~(df_latest["PID_Index"].values < stored["PID_Index"].values)
+            ]
+        self.latest = self._upsert(self.latest, df_latest)
+
+        if self.details is not None:
+            self._update_project_ages(
+                self.details.index
+                if ages_advanced
+                else self.details.index.intersection(updated_pids)
+            )
+        refresh_pids = (
+            self.details.index if ages_advanced else updated_pids
+        )
+
+        for interval in self.change_year_intervals:
+            mask = (
+                data["Change_Year"].values <= interval if interval else None
+            )
+            df_endstate = _gather_records(
+                data,
+                _last_record_positions(data, order, mask),
+                endstate_columns,
+            )
+
+            # only keep new records that succeed the stored endstate record
+            if self.endstate[interval] is not None:
+                stored_index = (
+                    self.endstate[interval]["PID_Index"]
+                    .reindex(df_endstate.index)
+                    .values
+                )
+                df_endstate = df_endstate.loc[
+                    ~(df_endstate["PID_Index"].values < stored_index)
+                ]
+
+            if len(df_endstate):
+                self.endstate[interval] = self._upsert(
+                    self.endstate[interval], df_endstate
+                )
+
+            self._refresh_interval(interval, refresh_pids)
+
+        return self.to_dict()
+
+    def _refresh_interval(self, interval, pids):
+        """Recomputes the interval data rows of the specified PIDs"""
+        if self.details is None or self.endstate[interval] is None:
+            return
+
+        df_details = self.details.loc[self.details.index.intersection(pids)]
+        if interval:
+            ages = df_details["Current_Project_Year"].values
+            df_details = df_details.loc[
+                ages >= interval if self.inclusive_stop else ages > interval
+            ]
+
+        df_features = _join_gathered_records(
+            df_details.rename(columns=info_column_rename_dict),
+            self.endstate[interval]
+            .loc[self.endstate[interval].index.intersection(pids)]
+            .rename(columns=endstate_column_rename_dict),
+        ).set_index("PID")
+
+        if self.interval_dict[interval] is not None:
+            self.interval_dict[interval] = self.interval_dict[interval].drop(
+                pids, errors="ignore"
+            )
+
+        self.interval_dict[interval] = self._upsert(
+            self.interval_dict[interval], df_features
+        )
+
+    def interval_data(self, change_year_interval):
+        """Returns the current interval data for one change_year_interval
+
+        :param change_year_interval: one of the store's change_year_intervals
+
+        :return: pd.DataFrame matching the ``generate_interval_data()`` output
+                 for the records applied to the store so far
+        """
+        df = self.interval_dict[change_year_interval]
+
+        return df.reset_index() if df is not None else None
+
+    def to_dict(self):
+        """Returns a dict mapping each change_year_interval to its interval data
+        """
+        return {
+            interval: self.interval_data(interval)
+            for interval in self.change_year_intervals
+        }
+
+    def save(self, filepath):
+        """Saves the store to disk as a pickle file
+
+        :param filepath: string path of the file to which the store is saved
+        """
+        pd.to_pickle(self, filepath)
+
+    @classmethod
+    def load(cls, filepath):
+        """Loads a store previously saved with ``IntervalStateStore.save()``
+
+        :param filepath: string path of the saved store
+
+        :return: the loaded IntervalStateStore object
+        """
+        return pd.read_pickle(filepath)
+
+
+class ProjectIndex:
+    """Change records sorted by project, with CSR-style offsets per PID
+
+    The records are sorted once by PID and record_index (optionally by a
+    date column first), and the sorted data is held alongside an array of
+    offsets such that the records of the i-th unique PID are the rows
+    ``offsets[i]:offsets[i + 1]`` of the sorted data. Looking up a project's
+    history is then a dictionary lookup and a slice rather than a boolean
+    mask over the full table.
+
+    :param data: pd.DataFrame of the cleaned capital projects change records
+                 data
+    :param record_index: string name of column containing PID ordinal
+                         indices (default record_index='PID_Index')
+    :param date_col: string name of a date column by which each project's
+                     records are ordered before record_index, or None to
+                     order by record_index only (default date_col=None)
+    """
+
+    def __init__(self, data, record_index="PID_Index", date_col=None):
+        self.record_index = record_index
+        self.date_col = date_col
+
+        if date_col is None:
+            self.order = _sort_record_positions(data, record_index)
+            self.dates = None
+        else:
+            dates = pd.to_datetime(data[date_col]).values
+            self.order = np.lexsort(
+                (data[record_index].values, dates, data["PID"].values)
+            )
+            self.dates = dates[self.order]
+
+        self.data = data.iloc[self.order].reset_index(drop=True)
+
+        pids = self.data["PID"].values
+        starts = np.flatnonzero(np.r_[True, pids[1:] != pids[:-1]])
+        self.pids = pids[starts]
+        self.offsets = np.r_[starts, len(pids)]
+        self._pid_codes = {pid: i for i, pid in enumerate(self.pids)}
+
+    def __len__(self):
+        return len(self.pids)
+
+    def __contains__(self, pid):
+        return pid in self._pid_codes
+
+    def codes(self):
+        """Returns the PID code, i.e. position in ``pids``, of each record
+
+        :return: np.ndarray of integer codes aligned with the sorted data
+        """
+        return np.repeat(np.arange(len(self.pids)), np.diff(self.offsets))
+
+    def slice(self, pid):
+        """Returns the slice of the sorted data holding a PID's records
+
+        :param pid: integer PID of the project
+
+        :return: slice object for use with ``data.iloc``
+        """
+        code = self._pid_codes[pid]
+
+        return slice(self.offsets[code], self.offsets[code + 1])
+
+    def project(self, pid):
+        """Returns the change records of one project
+
+        :param pid: integer PID of the project
+
+        :return: pd.DataFrame of the project's records in sorted order
+        """
+        return self.data.iloc[self.slice(pid)]
+
+
+class AsOfIndex:
+    """Sorted per-PID index of change records for point-in-time queries
+
+    Records are held in a ``ProjectIndex`` sorted by PID,
+    ``Date_Reported_As_Of`` and ``PID_Index``, and each record is assigned an
+    integer key combining its PID code with the dense rank of its reported
+    date. The latest record of every PID at or before a date is then found
+    with a single binary search per PID, so a query costs O(P log R) for P
+    projects and R records rather than a scan of the full table.
+
+    :param data: pd.DataFrame of the cleaned capital projects change records
+                 data
+    :param date_col: string name of the column containing the date each
+                     record was reported (default
+                     date_col='Date_Reported_As_Of')
+    :param record_index: string name of column containing PID ordinal
+                         indices, used to order records reported on the same
+                         date (default record_index='PID_Index')
+    """
+
+    def __init__(
+        self, data, date_col="Date_Reported_As_Of", record_index="PID_Index"
+    ):
+        self.index = ProjectIndex(data, record_index, date_col)
+        self.data = self.index.data
+        self.pids = self.index.pids
+
+        self.dates, date_ranks = np.unique(
+            self.index.dates, return_inverse=True
+        )
+        self._stride = len(self.dates) + 1
+        self.keys = (
+            self.index.codes().astype(np.int64) * self._stride + date_ranks
+        )
+
+    def positions(self, as_of_date):
+        """Returns the integer positions of each PID's latest record
+
+        :param as_of_date: datetime-like date at or before which records are
+                           considered
+
+        :return: np.ndarray of integer positions into the sorted ``data``
+                 attribute, ordered by PID, PIDs with no record at or before
+                 as_of_date are omitted
+        """
+        positions, _ = self._search(np.atleast_1d(as_of_date))
+
+        return positions
+
+    def _search(self, as_of_dates):
+        """Returns positions and date indices of the latest records per date"""
+        as_of_dates = pd.to_datetime(as_of_dates).values
+        n_ranks = np.searchsorted(self.dates, as_of_dates, side="right")
+
+        # the last key at or below (pid code, rank of latest date <= as_of)
+        pid_offsets = np.arange(len(self.pids), dtype=np.int64) * self._stride
+        targets = pid_offsets[None, :] + n_ranks[:, None]
+        found = np.searchsorted(self.keys, targets.ravel(), side="left") - 1
+
+        valid = (found >= 0) & (
+            self.keys[np.maximum(found, 0)] // self._stride
+            == np.tile(np.arange(len(self.pids)), len(as_of_dates))
+        )
+        date_indices = np.repeat(np.arange(len(as_of_dates)), len(self.pids))
+
+        return found[valid], date_indices[valid]
+
+    def as_of(self, as_of_date, columns=None):
+        """Returns the latest record of each PID at or before a date
+
+        :param as_of_date: datetime-like date at or before which records are
+                           considered
+        :param columns: list of column names to return, or None to return all
+                        columns (default columns=None)
+
+        :return: pd.DataFrame with one record per PID, ordered by PID, with the
+                 index reset
+        """
+        df = self.data.iloc[self.positions(as_of_date)]
+
+        if columns is not None:
+            df = df[columns]
+
+        return df.reset_index(drop=True)
+
+    def as_of_many(self, as_of_dates, columns=None):
+        """Returns the latest record of each PID for each of several dates
+
+        All dates are resolved with one vectorized binary search.
+
+        :param as_of_dates: list-like of datetime-like dates
+        :param columns: list of column names to return, or None to return all
+                        columns (default columns=None)
+
+        :return: pd.DataFrame in long format with an ``As_Of_Date`` first
+                 column, ordered by As_Of_Date (in the order given) and PID,
+                 with the index reset
+        """
+        as_of_dates = pd.to_datetime(np.atleast_1d(as_of_dates))
+        positions, date_indices = self._search(as_of_dates)
+
+        df = self.data.iloc[positions]
+
+        if columns is not None:
+            df = df[columns]
+
+        df = df.reset_index(drop=True)
+        df.insert(0, "As_Of_Date", as_of_dates.values[date_indices])
+
+        return df
+
+
+def apply_dtype_schema(df, dtypes=change_record_dtypes):
+    """Converts columns of the change records data to memory-compact dtypes
+
+    Categorical and downcast numeric dtypes are preserved by
+    ``extract_project_details()``, ``project_interval_endstate()``,
+    ``join_data_endstate()`` and ``build_interval_data()``, so the resulting
+    interval data carries the same dtypes. Budget columns are left as float64
+    to avoid losing precision on large budgets.
+
+    :param df: pd.DataFrame of the cleaned capital projects change records data
+    :param dtypes: dict mapping column names to dtypes, columns not present in
+                   df are ignored (default dtypes=change_record_dtypes module
+                   variable)
+
+    :return: pd.DataFrame with the columns converted
+    """
+    return df.astype({col: dtype for col, dtype in dtypes.items() if col in df})
+
+
+def iter_change_records(
+    filepath, chunksize=100000, compact=True, intern_text=True, **kwargs
+):
+    """Reads a change records .csv file as a stream of dataframe chunks
+
+    Spaces in column headers (as found in the raw NYC capital projects data)
+    are replaced with underscores. Columns are read with the memory-compact
+    ``change_record_dtypes`` (the ``categorical_columns`` as categoricals),
+    and repeated values of the long ``text_columns`` are replaced by
+    references to a single shared string object, so that each distinct
+    project name or description is held in memory only once across all
+    chunks.
+
+    :param filepath: string path of the raw or cleaned change records .csv
+    :param chunksize: integer number of rows read per chunk (default
+                      chunksize=100000)
+    :param compact: boolean, whether to read columns with the
+                    ``change_record_dtypes`` (default compact=True)
+    :param intern_text: boolean, whether to deduplicate ``text_columns``
+                        values across chunks (default intern_text=True)
+    :param kwargs: any additional arguments are passed to ``pd.read_csv``
+
+    :return: generator of pd.DataFrame chunks of the change records
+    """
+    header = pd.read_csv(filepath, nrows=0).columns
+    rename_dict = {col: col.replace(" ", "_") for col in header}
+
+    if compact:
+        kwargs.setdefault(
+            "dtype",
+            {
+                col: change_record_dtypes[name]
+                for col, name in rename_dict.items()
+                if name in change_record_dtypes
+            },
+        )
+
+    # shared pool of text values, so repeats across chunks are one object
+    text_pool = {}
+
+    for chunk in pd.read_csv(filepath, chunksize=chunksize, **kwargs):
+        chunk = chunk.rename(columns=rename_dict)
+
+        if intern_text:
+            for col in chunk.columns.intersection(text_columns):
+                codes, uniques = pd.factorize(chunk[col])
+                uniques = np.array(
+                    [text_pool.setdefault(value, value) for value in uniques]
+                    + [np.nan],
+                    dtype=object,
+                )
+                # missing values have code -1, i.e. the trailing np.nan
+                chunk[col] = uniques[codes]
+
+        yield chunk
+
+
+def read_change_records(filepath, chunksize=100000, **kwargs):
+    """Reads a change records .csv file in chunks into a single dataframe
+
+    See ``iter_change_records()`` for how the records are encoded while they
+    are read.
+
+    :param filepath: string path of the raw or cleaned change records .csv
+    :param chunksize: integer number of rows read per chunk (default
+                      chunksize=100000)
+    :param kwargs: any additional arguments are passed to
+                   ``iter_change_records()``
+
+    :return: pd.DataFrame of the change records
+    """
+    return _concat_records(
+        list(iter_change_records(filepath, chunksize, **kwargs)),
+        ignore_index=True,
+    )
+
+
+def stream_interval_data(
+    filepath,
+    change_year_intervals,
+    inclusive_stop=True,
+    chunksize=100000,
+    store=None,
+    **kwargs
+):
+    """Generates interval datasets from a cleaned change records .csv stream
+
+    Chunks from ``iter_change_records()`` are applied one at a time to an
+    ``IntervalStateStore``, so that only one chunk of the change records, plus
+    the per-PID interval state, is held in memory at once. Chunks may split a
+    project's records in any order.
+
+    :param filepath: string path of the cleaned change records .csv
+    :param change_year_intervals: list of integers (or None, indicating all
+                                  years' worth of changes) for which to
+                                  generate interval datasets
+    :param inclusive_stop: boolean, passed through to the interval subsetting
+                           as in ``generate_interval_data()`` (default
+                           inclusive_stop=True)
+    :param chunksize: integer number of rows read per chunk (default
+                      chunksize=100000)
+    :param store: an existing IntervalStateStore to update, or None to create
+                  a new one (default store=None)
+    :param kwargs: any additional arguments are passed to
+                   ``iter_change_records()``
+
+    :return: the updated IntervalStateStore object, use its ``to_dict()`` or
+             ``interval_data()`` methods to retrieve the interval datasets
+    """
+    if store is None:
+        store = IntervalStateStore(change_year_intervals, inclusive_stop)
+
+    for chunk in iter_change_records(filepath, chunksize, **kwargs):
+        store.update(chunk)
+
+    return store
+
+
+def save_interval_data(df, save_path, file_format="csv"):
+    """Saves an interval dataframe to disk in the specified file format
+
+    :param df: pd.DataFrame output from ``generate_interval_data()``
+    :param save_path: string path of the file to write
+    :param file_format: string, one of 'csv', 'parquet' or 'feather'. The
+                        columnar 'parquet' and 'feather' formats preserve all
+                        dtypes, including datetimes, and require the
+                        ``pyarrow`` package (default file_format='csv')
+    """
+    if file_format == "parquet":
+        df.to_parquet(save_path, index=False)
+    elif file_format == "feather":
+        df.reset_index(drop=True).to_feather(save_path)
+    else:
+        df.to_csv(save_path, index=False)
+
+
+def load_interval_data(filepath, file_format=None):
+    """Loads an interval dataframe saved by ``generate_interval_data()``
+
+    Parquet and feather files are read with their stored dtypes. For .csv
+    files, the columns in ``interval_datetime_columns`` are parsed as
+    datetimes.
+
+    :param filepath: string path of the saved interval dataframe
+    :param file_format: string or None, one of 'csv', 'parquet' or 'feather',
+                        if None the format is inferred from the file extension
+                        (default file_format=None)
+
+    :return: pd.DataFrame of the saved interval data
+    """
+    if file_format is None:
+        file_format = os.path.splitext(filepath)[1].lstrip(".").lower()
+
+    if file_format == "parquet":
+        return pd.read_parquet(filepath)
+    elif file_format == "feather":
+        return pd.read_feather(filepath)
+    elif file_format == "csv":
+        df = pd.read_csv(filepath)
+        for col in df.columns.intersection(interval_datetime_columns):
+            df[col] = pd.to_datetime(df[col])
+        return df
+    else:
+        raise ValueError(
+            "file_format only accepts {}, but you have entered: {}"
+            "".format(interval_file_formats, file_format)
+        )
+
+
 def print_interval_dict(
     datadict_dir="../references/data_dicts/",
     datadict_filename="data_dict_interval.csv",
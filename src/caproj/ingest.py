@@ -0,0 +1,274 @@
+"""
+caproj.ingest
+~~~~~~~~~~~~~
+
+This module contains functions for converting the raw NYC capital projects
+change records data into the cleaned change records data used by
+:mod:`caproj.datagen`
+
+**Module variables:**
+
+.. autosummary::
+
+   raw_datetime_formats
+   required_columns
+   phase_labels
+   unspecified_columns
+
+**Module functions:**
+
+.. autosummary::
+
+   parse_datetime_columns
+   clean_change_records
+   label_phases
+   add_derived_columns
+   ingest_change_records
+
+"""
+
+import pandas as pd
+
+from .datagen import (
+    apply_dtype_schema,
+    read_change_records,
+    save_interval_data,
+    years_since,
+)
+
+#: Dictionary mapping raw datetime column names to their explicit formats
+raw_datetime_formats = {
+    "Date_Reported_As_Of": "%m/%d/%Y %I:%M:%S %p",
+    "Design_Start": "%m/%d/%Y",
+    "Forecast_Completion": "%m/%d/%Y",
+}
+
+#: List of columns each change record must contain to be kept when cleaning
+required_columns = [
+    "Date_Reported_As_Of",
+    "PID",
+    "Design_Start",
+    "Budget_Forecast",
+]
+
+#: Dictionary mapping raw project phases to their ordered phase labels
+phase_labels = {
+    "Scoping/Planning": "1-Scoping/Planning",
+    "Design": "2-Design",
+    "Construction Procurement": "3-Construction Procurement",
+    "Construction": "4-Construction",
+    "Close-Out": "5-Close-Out",
+}
+
+#: List of attribute columns in which missing values are set to 'not_specified'
+unspecified_columns = ["Description", "Borough", "Client_Agency"]
+
+
+def parse_datetime_columns(df, datetime_formats=raw_datetime_formats):
+    """Parses datetime columns using explicit formats
+
+    Supplying the format avoids pandas inferring it value by value, and
+    ``cache=True`` parses each distinct date string only once, which suits
+    the few dozen distinct ``Date_Reported_As_Of`` values of the raw data.
+
+    :param df: pd.DataFrame of the change records data, with underscored
+               column names
+    :param datetime_formats: dict mapping column names to ``strftime`` format
+                             strings (default
+                             datetime_formats=raw_datetime_formats module
+                             variable)
+
+    :return: Original pd.DataFrame with datetime columns parsed
+    """
+    for col, fmt in datetime_formats.items():
+        df[col] = pd.to_datetime(df[col], format=fmt, cache=True)
+
+    return df
+
+
+def clean_change_records(
+    df,
+    required_columns=required_columns,
+    unspecified_columns=unspecified_columns,
+):
+    """Drops incomplete and duplicated change records and sorts the remainder
+
+    Missing values in the ``unspecified_columns`` are set to
+    ``'not_specified'``, and each project's ``Design_Start`` is set to the
+    earliest design start reported for that project, so that all of a
+    project's records measure their ages from the same date.
+
+    :param df: pd.DataFrame of the change records data with parsed datetime
+               columns
+    :param required_columns: list of column names for which records with
+                             missing values are dropped (default
+                             required_columns=required_columns module variable)
+    :param unspecified_columns: list of column names in which missing values
+                                are set to 'not_specified' (default
+                                unspecified_columns=unspecified_columns module
+                                variable)
+
+    :return: pd.DataFrame of the remaining change records, sorted by PID and
+             Date_Reported_As_Of, with the index reset
+    """
+    df = df.dropna(subset=required_columns)
+    df = df.drop_duplicates(subset=["PID", "Date_Reported_As_Of"], keep="last")
+    df = df.sort_values(by=["PID", "Date_Reported_As_Of"]).reset_index(
+        drop=True
+    )
+
+    for col in unspecified_columns:
+        df[col] = df[col].astype(object).fillna("not_specified")
+
+    df["Design_Start"] = df.groupby("PID", sort=False)[
+        "Design_Start"
+    ].transform("min")
+
+    return df
+
+
+def label_phases(df, phase_labels=phase_labels):
+    """Replaces the raw Current_Phase values with their ordered phase labels
+
+    Phases missing from ``phase_labels`` are left unchanged.
+
+    :param df: pd.DataFrame of the change records data
+    :param phase_labels: dict mapping raw phase names to phase labels
+                         (default phase_labels=phase_labels module variable)
+
+    :return: Original pd.DataFrame with the Current_Phase values relabeled
+    """
+    phases = df["Current_Phase"].astype(object)
+    df["Current_Phase"] = phases.map(phase_labels).fillna(phases)
+
+    return df
+
+
+def add_derived_columns(df, compiled_date=None):
+    """Adds the derived columns expected by :mod:`caproj.datagen`
+
+    The following columns are added to the sorted change records:
+
+    * ``PID_Index``: the ordinal position of each record among its project's
+      records, starting at 0
+    * ``Record_ID``: the string ``"{PID}-{PID_Index}"``
+    * ``Original_Budget`` and ``Original_Schedule``: the ``Budget_Forecast``
+      and ``Forecast_Completion`` of each project's first record, before that
+      record's ``Latest_Budget_Changes`` and ``Latest_Schedule_Changes`` (in
+      days) were applied
+    * ``Change_Years`` and ``Change_Year``: the years from ``Design_Start`` to
+      ``Date_Reported_As_Of``, in decimal form and as the project year in
+      which the change was reported (i.e. rounded up, so that changes in a
+      project's first year have a ``Change_Year`` of 1)
+    * ``Current_Project_Years`` and ``Current_Project_Year``: the years from
+      ``Design_Start`` to the date the dataset was compiled, in decimal form
+      and rounded up in the same way
+
+    :param df: pd.DataFrame output from the clean_change_records() function
+    :param compiled_date: datetime-like or None, the date the dataset was
+                          compiled, if None the latest Date_Reported_As_Of
+                          value is used (default compiled_date=None)
+
+    :return: Original pd.DataFrame with the derived columns appended
+    """
+    if compiled_date is None:
+        compiled_date = df["Date_Reported_As_Of"].max()
+
+    df["PID_Index"] = df.groupby("PID", sort=False).cumcount()
+    df["Record_ID"] = (
+        df["PID"].astype(str) + "-" + df["PID_Index"].astype(str)
+    )
+
+    # values of each project's first record, before its latest changes
+    first_record = df["PID_Index"] == 0
+    original_budget = df["Budget_Forecast"] - df[
+        "Latest_Budget_Changes"
+    ].fillna(0)
+    original_schedule = df["Forecast_Completion"] - pd.to_timedelta(
+        df["Latest_Schedule_Changes"].fillna(0), unit="D"
+    )
+    df["Original_Budget"] = (
+        original_budget.where(first_record)
+        .groupby(df["PID"], sort=False)
+        .transform("first")
+    )
+    df["Original_Schedule"] = (
+        original_schedule.where(first_record)
+        .groupby(df["PID"], sort=False)
+        .transform("first")
+    )
+
+    df["Change_Years"], df["Change_Year"] = years_since(
+        df["Design_Start"], df["Date_Reported_As_Of"]
+    )
+    df["Current_Project_Years"], df["Current_Project_Year"] = years_since(
+        df["Design_Start"], pd.Timestamp(compiled_date)
+    )
+
+    return df
+
+
+def ingest_change_records(
+    filepath,
+    save_path=None,
+    file_format="csv",
+    compiled_date=None,
+    chunksize=100000,
+    compact=True,
+    verbose=1,
+):
+    """Converts the raw change records .csv into the cleaned change records
+
+    The raw file is read in chunks with
+    :func:`caproj.datagen.read_change_records`, its space-separated headers
+    are replaced with underscores, and the records are passed through
+    ``parse_datetime_columns()``, ``clean_change_records()``,
+    ``label_phases()`` and ``add_derived_columns()``. The resulting columns
+    are then converted to the memory-compact
+    :data:`caproj.datagen.change_record_dtypes`.
+
+    :param filepath: string path of the raw NYC capital projects .csv file
+                     (i.e. ``../data/raw/NYC_capital_projects_20190901.csv``)
+    :param save_path: string or None, path to which the cleaned records are
+                      saved, if None they are not saved (default
+                      save_path=None)
+    :param file_format: string, one of 'csv', 'parquet' or 'feather',
+                        indicating the format used to save the cleaned
+                        records (default file_format='csv')
+    :param compiled_date: datetime-like or None, passed to
+                          add_derived_columns() (default compiled_date=None)
+    :param chunksize: integer number of rows read per chunk (default
+                      chunksize=100000)
+    :param compact: boolean, whether to convert the cleaned records to the
+                    memory-compact dtypes (default compact=True)
+    :param verbose: integer, default verbose=1 prints the number of records
+                    and projects in the cleaned data, otherwise that
+                    information is not printed
+
+    :return: pd.DataFrame of the cleaned change records
+    """
+    df = read_change_records(filepath, chunksize=chunksize, compact=compact)
+    df = parse_datetime_columns(df)
+    df = clean_change_records(df)
+    df = label_phases(df)
+    df = add_derived_columns(df, compiled_date=compiled_date)
+
+    if compact:
+        df = apply_dtype_schema(df)
+
+    if verbose == 1:
+        print(
+            "The cleaned change records contain {} records for {} unique "
+            "projects\n".format(len(df), df["PID"].nunique())
+        )
+
+    if save_path:
+        save_interval_data(df, save_path, file_format=file_format)
+
+        if verbose == 1:
+            print(
+                "The cleaned change records were saved to .{} at:"
+                "\n\n\t{}\n".format(file_format, save_path)
+            )
+
+    return df
@@ -9,13 +9,214 @@ This module contains functions for generating fitted models and summarizing the
 .. autosummary::
 
    generate_model_dict
+   run_model_grid
+   predict_to_memmap
    print_model_results
 
 """
+import os
+import tempfile
+
 import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from scipy import sparse
 from sklearn.metrics import r2_score
 
 
+def _fit_predict_output(
+    model, X_train, X_test, y, formula, kwargs, sm_data=None, predict=True
+):
+    """Fits a model for a single output y and predicts on X_train and X_test
+
+    For statsmodels formulas, sm_data is a dataframe already holding both
+    the X and y columns, otherwise y is joined to X_train.
+
+    :return: tuple of the fitted model and its train and test predictions,
+             each reshaped to a single column, or None if predict=False
+    """
+    if formula is not None:
+        if sm_data is None:
+            sm_data = X_train.join(y)
+        fit_model = model(formula=formula, data=sm_data).fit()
+    else:
+        fit_model = model(**kwargs).fit(X_train, y)
+
+    if not predict:
+        return fit_model, None, None
+
+    return (
+        fit_model,
+        np.array(fit_model.predict(X_train)).reshape(-1, 1),
+        np.array(fit_model.predict(X_test)).reshape(-1, 1),
+    )
+
+
+def _read_only_values(df):
+    """Returns the values of df as a read-only array, a view where possible"""
+    values = df.to_numpy()
+    values.flags.writeable = False
+
+    return values
+
+
+def _y_column(y, i, y_variable):
+    """Returns the i-th output of y, a dataframe or a 2D array"""
+    if isinstance(y, np.ndarray):
+        return y[:, i]
+
+    return y[y_variable]
+
+
+def _fit_model_dict(
+    model,
+    model_descr,
+    X_train,
+    X_test,
+    y_train,
+    y_test,
+    y_variables,
+    multioutput,
+    verbose,
+    predictions,
+    scores,
+    model_api,
+    sm_formulas,
+    y_stored,
+    n_jobs,
+    kwargs,
+    sm_data=None,
+    predictions_dir=None,
+):
+    """Fits the model and builds the model dict of generate_model_dict()
+
+    The inputs are used as they are, without validation, copies or index
+    resets, which are the responsibility of the caller. y_train and y_test
+    are dataframes or 2D arrays with columns ordered as y_variables, and
+    sm_data is an optional dataframe of the X_train and y_train columns used
+    for statsmodels fits. If predictions_dir is provided, predictions are
+    written to .npy memmaps in a new subdirectory of it with
+    predict_to_memmap().
+    """
+    # initialize fit model list
+    FitModel = []
+
+    # initialize formula to store when statsmodels
+    formulas = []
+
+    # Fit model with parameters specified by kwargs
+    if model_api == "sklearn" and multioutput:
+        FitModel.append(model(**kwargs).fit(X_train, y_train))
+
+    # Note that the **kwargs are passed to the .fit() method in the keras api
+    # Keras models must be defined and compiled prior to passing to this function
+    if model_api == "keras":
+        FitModel.append(model.fit(X_train, y_train, **kwargs))
+
+    # statsmodel fit using statsmodels.formula.api, so need to record
+    # resulting formulas for use while fitting and in final dict
+    if model_api == "statsmodels":
+        formulas = [
+            y + " ~ {}".format(sm_formulas[i])
+            for i, y in enumerate(y_variables)
+        ]
+
+    # fit separate models for each output, generating predictions on both
+    # train and test data, in parallel if n_jobs is specified
+    per_output = model_api == "statsmodels" or (
+        model_api == "sklearn" and not multioutput
+    )
+    if per_output:
+        output_results = Parallel(n_jobs=n_jobs)(
+            delayed(_fit_predict_output)(
+                model,
+                X_train,
+                X_test,
+                _y_column(y_train, i, y),
+                formulas[i] if formulas else None,
+                kwargs,
+                sm_data,
+                predictions_dir is None,
+            )
+            for i, y in enumerate(y_variables)
+        )
+        FitModel = [fit_model for fit_model, _, _ in output_results]
+
+    # generate and save predictions on both train and test data
+    if predictions_dir is not None:
+        per_model_columns = per_output or not multioutput
+        os.makedirs(predictions_dir, exist_ok=True)
+        # files still mapped by earlier model dicts must not be overwritten
+        predictions_dir = tempfile.mkdtemp(
+            prefix="predictions_", dir=predictions_dir
+        )
+        train_pred = predict_to_memmap(
+            FitModel,
+            X_train,
+            os.path.join(predictions_dir, "predictions_train.npy"),
+            per_model_columns=per_model_columns,
+        )
+        test_pred = predict_to_memmap(
+            FitModel,
+            X_test,
+            os.path.join(predictions_dir, "predictions_test.npy"),
+            per_model_columns=per_model_columns,
+        )
+
+    elif per_output:
+        train_pred = np.hstack([pred for _, pred, _ in output_results])
+        test_pred = np.hstack([pred for _, _, pred in output_results])
+
+    elif model_api == "keras" and not multioutput:
+        train_pred = np.hstack(
+            [
+                np.array(model.predict(X_train)).reshape(-1, 1)
+                for model in FitModel
+            ]
+        )
+
+        test_pred = np.hstack(
+            [
+                np.array(model.predict(X_test)).reshape(-1, 1)
+                for model in FitModel
+            ]
+        )
+
+    else:
+        train_pred = FitModel[0].predict(X_train)
+        test_pred = FitModel[0].predict(X_test)
+
+    # store fitted model, predictions and scores to dict
+    model_dict = {"description": model_descr}
+
+    model_dict["model"] = FitModel
+    model_dict["y_variables"] = y_variables
+    model_dict["formulas"] = formulas
+
+    if y_stored:
+        model_dict["y_values"] = {
+            "train": y_train,
+            "test": y_test,
+        }
+
+    if predictions:
+        model_dict["predictions"] = {
+            "train": train_pred,
+            "test": test_pred,
+        }
+
+    if scores:
+        model_dict["score"] = {
+            "train": r2_score(y_train, train_pred, multioutput="raw_values"),
+            "test": r2_score(y_test, test_pred, multioutput="raw_values"),
+        }
+
+    if verbose:
+        print("\t{}".format(FitModel))
+
+    return model_dict
+
+
 def generate_model_dict(
     model,
     model_descr,
@@ -30,6 +231,9 @@ def generate_model_dict(
     model_api="sklearn",
     sm_formulas=None,
     y_stored=True,
+    n_jobs=None,
+    copy=True,
+    predictions_dir=None,
     **kwargs
 ):
     """Fits the specified model type and generates a dictionary of results
@@ -67,7 +271,13 @@ def generate_model_dict(
     :param model_descr: a brief string describing the model (cannot exceed 80
                         characters)
     :param X_train, X_test, y_train, y_test: the datasets on which to fit and
-                                             evaluate the model
+                                             evaluate the model, X_train and
+                                             X_test may also be
+                                             ``scipy.sparse`` matrices (i.e.
+                                             from
+                                             ``caproj.scale.sparse_design_matrix``)
+                                             for sklearn models accepting
+                                             sparse input
     :param multioutput: Boolean, if True and sklearn model_api, will attempt
                         fitting a single multioutput model, if False or 'statsmodel'
                         model_api fits separate models for each output
@@ -85,6 +295,34 @@ def generate_model_dict(
                      resulting dictionary. It is convenient to keep these stored
                      alongside the predictions for easier evaluation later (default
                      is y_stored=True)
+    :param n_jobs: integer or None, number of parallel jobs used to fit and
+                   predict the separate per-output models fitted when
+                   multioutput=False or with the 'statsmodels' model_api,
+                   via ``joblib.Parallel`` (processes by default, use a
+                   ``joblib.parallel_backend("threading")`` context for
+                   threads), if None the models are fitted serially. To set
+                   the n_jobs of the model itself, pass a
+                   ``functools.partial`` of the model (default n_jobs=None)
+    :param copy: boolean, if False the inputs are neither copied nor have
+                 their index reset. X_train and X_test are passed to the model
+                 as they are, y_train and y_test are aligned with them by
+                 position, and the y values are stored as read-only NumPy
+                 arrays viewing the input data rather than as dataframe copies.
+                 For statsmodels, a single dataframe of the X and all y
+                 columns is built instead of a join per output. Predictions
+                 and scores are the same as with copy=True (default
+                 copy=True)
+    :param predictions_dir: string path of a directory or None, if provided
+                            the train and test predictions are written
+                            chunk by chunk into ``predictions_train.npy``
+                            and ``predictions_test.npy`` memmap files with
+                            ``predict_to_memmap()``, and the returned dict
+                            holds read-only memmaps of those files rather
+                            than in-memory arrays. Each call writes to a new,
+                            uniquely named subdirectory of predictions_dir,
+                            which is given by the ``filename`` attribute of
+                            the memmaps, so the directory can be reused
+                            (default predictions_dir=None)
     :param kwargs: are optional arguments that pass directly to the model object
                      at time of initialization, or in the case of the 'keras' model
                      api, they pass to the ``keras.mdoel.fit()`` method
@@ -108,93 +346,294 @@ def generate_model_dict(
             "but you have entered: {}".format(model_api)
         )
 
-    # reset indices to prevent joining and index errors, particularly if using
-    # scaled X dataframes
-    X_train = X_train.copy().reset_index(drop=True)
-    X_test = X_test.copy().reset_index(drop=True)
-    y_train = y_train.copy().reset_index(drop=True)
-    y_test = y_test.copy().reset_index(drop=True)
-
-    # initialize fit model list
-    FitModel = []
-
-    # initialize formula to store when statsmodels
-    formulas = []
+    # sparse X matrices have no index and are passed to the model as they are
+    X_sparse = sparse.issparse(X_train) or sparse.issparse(X_test)
+    if X_sparse and model_api != "sklearn":
+        raise ValueError(
+            "sparse X matrices are only accepted by the 'sklearn' model_api, "
+            "but you have entered: {}".format(model_api)
+        )
 
     # store exogen
     y_variables = list(y_train.columns)
+    sm_data = None
 
-    # Fit model with parameters specified by kwargs
-    if model_api == "sklearn" and multioutput:
-        FitModel.append(model(**kwargs).fit(X_train, y_train))
+    if copy:
+        # reset indices to prevent joining and index errors, particularly if
+        # using scaled X dataframes
+        if not X_sparse:
+            X_train = X_train.copy().reset_index(drop=True)
+            X_test = X_test.copy().reset_index(drop=True)
+        y_train = y_train.copy().reset_index(drop=True)
+        y_test = y_test.copy().reset_index(drop=True)
 
-    if model_api == "sklearn" and not multioutput:
-        for col in y_variables:
-            FitModel.append(model(**kwargs).fit(X_train, y_train[col]))
+    else:
+        # y values are aligned with X by position, as read-only arrays
+        y_train = _read_only_values(y_train)
+        y_test = _read_only_values(y_test)
+
+        # a single frame holding all outputs replaces a join per output
+        if model_api == "statsmodels":
+            sm_data = X_train.assign(
+                **{y: y_train[:, i] for i, y in enumerate(y_variables)}
+            )
 
-    # Note that the **kwargs are passed to the .fit() method in the keras api
-    # Keras models must be defined and compiled prior to passing to this function
-    if model_api == "keras":
-        FitModel.append(model.fit(X_train, y_train, **kwargs))
+    return _fit_model_dict(
+        model,
+        model_descr,
+        X_train,
+        X_test,
+        y_train,
+        y_test,
+        y_variables,
+        multioutput,
+        verbose,
+        predictions,
+        scores,
+        model_api,
+        sm_formulas,
+        y_stored,
+        n_jobs,
+        kwargs,
+        sm_data,
+        predictions_dir,
+    )
 
-    # statsmodel fit using statsmodels.formula.api, so need to record
-    # resulting formulas for use while fitting and in final dict
-    if model_api == "statsmodels":
-        for i, y in enumerate(y_variables):
-            formulas.append(y + " ~ {}".format(sm_formulas[i]))
-            FitModel.append(
-                model(formula=formulas[i], data=X_train.join(y_train[y])).fit()
-            )
 
-    # generate and save predictions on both train and test data
-    if model_api == "statsmodels" or not multioutput:
-        train_pred = np.hstack(
-            [
-                np.array(model.predict(X_train)).reshape(-1, 1)
-                for model in FitModel
-            ]
-        )
+def _rows(X, start, stop):
+    """Returns rows start to stop of a dataframe, array or sparse matrix"""
+    if hasattr(X, "iloc"):
+        return X.iloc[start:stop]
 
-        test_pred = np.hstack(
-            [
-                np.array(model.predict(X_test)).reshape(-1, 1)
-                for model in FitModel
-            ]
+    return X[start:stop]
+
+
+def predict_to_memmap(
+    models, X, filepath, chunksize=100000, per_model_columns=None
+):
+    """Writes model predictions chunk by chunk into a .npy memmap file
+
+    The output file is preallocated from the shape of the first chunk's
+    predictions, and each chunk of X is predicted and written straight into
+    its rows, so neither the full prediction array nor per-model copies of
+    it are held in memory.
+
+    :param models: list of fitted model objects, i.e. the 'model' entry of a
+                   generate_model_dict() dictionary
+    :param X: dataframe, array or sparse matrix of the data to predict on
+    :param filepath: string path of the .npy file to write, which must not
+                     exist yet, as it may still be memory-mapped elsewhere
+    :param chunksize: integer number of rows predicted at a time (default
+                      chunksize=100000)
+    :param per_model_columns: boolean or None, if True the predictions of each
+                              model are written to a column of their own, as
+                              for the per-output models of
+                              generate_model_dict(), if False the single
+                              model's predictions keep their shape, if None
+                              this is True when there are several models
+                              (default per_model_columns=None)
+
+    :return: read-only np.memmap of the predictions
+    """
+    if os.path.exists(filepath):
+        raise ValueError(
+            "predict_to_memmap only accepts a filepath that does not exist, "
+            "but you have entered: {}".format(filepath)
         )
 
-    else:
-        train_pred = FitModel[0].predict(X_train)
-        test_pred = FitModel[0].predict(X_test)
+    if per_model_columns is None:
+        per_model_columns = len(models) > 1
 
-    # store fitted model, predictions and scores to dict
-    model_dict = {"description": model_descr}
+    n_rows = X.shape[0]
+    predictions = None
 
-    model_dict["model"] = FitModel
-    model_dict["y_variables"] = y_variables
-    model_dict["formulas"] = formulas
+    for start in range(0, max(n_rows, 1), chunksize):
+        X_chunk = _rows(X, start, start + chunksize)
 
-    if y_stored:
-        model_dict["y_values"] = {
-            "train": y_train,
-            "test": y_test,
-        }
+        if not per_model_columns:
+            chunk_pred = np.asarray(models[0].predict(X_chunk))
+        else:
+            chunk_pred = np.hstack(
+                [
+                    np.array(model.predict(X_chunk)).reshape(-1, 1)
+                    for model in models
+                ]
+            )
 
-    if predictions:
-        model_dict["predictions"] = {
-            "train": train_pred,
-            "test": test_pred,
-        }
+        if predictions is None:
+            predictions = np.lib.format.open_memmap(
+                filepath,
+                mode="w+",
+                dtype=chunk_pred.dtype,
+                shape=(n_rows,) + chunk_pred.shape[1:],
+            )
 
-    if scores:
-        model_dict["score"] = {
-            "train": r2_score(y_train, train_pred, multioutput="raw_values"),
-            "test": r2_score(y_test, test_pred, multioutput="raw_values"),
-        }
+        stop = start + len(chunk_pred)
+        predictions[start:stop] = chunk_pred
 
-    if verbose:
-        print("\t{}".format(FitModel))
+    predictions.flush()
+    del predictions
 
-    return model_dict
+    return np.load(filepath, mmap_mode="r")
+
+
+def _grid_spec_descr(model, kwargs, features, max_model_descr=80):
+    """Returns a default model description for a model grid spec"""
+    descr = "{} {}{}".format(
+        getattr(model, "__name__", type(model).__name__),
+        kwargs,
+        "" if features is None else " ({} features)".format(len(features)),
+    )
+
+    return descr[:max_model_descr]
+
+
+def _fit_grid_spec(
+    model,
+    model_descr,
+    positions,
+    kwargs,
+    X_train,
+    X_test,
+    y_train,
+    y_test,
+    multioutput,
+    predictions,
+):
+    """Fits one model grid spec on the feature positions of shared X arrays
+
+    The true y values are not stored in the returned model dict, so that
+    worker processes do not send copies of them back to the parent.
+    """
+    if positions is not None:
+        X_train = X_train[:, positions]
+        X_test = X_test[:, positions]
+
+    return _fit_model_dict(
+        model=model,
+        model_descr=model_descr,
+        X_train=X_train,
+        X_test=X_test,
+        y_train=y_train,
+        y_test=y_test,
+        y_variables=list(y_train.columns),
+        multioutput=multioutput,
+        verbose=False,
+        predictions=predictions,
+        scores=True,
+        model_api="sklearn",
+        sm_formulas=None,
+        y_stored=False,
+        n_jobs=None,
+        kwargs=kwargs,
+    )
+
+
+def run_model_grid(
+    specs,
+    X_train,
+    X_test,
+    y_train,
+    y_test,
+    multioutput=True,
+    n_jobs=None,
+    predictions=True,
+    y_stored=True,
+):
+    """Fits a grid of sklearn model specifications on shared data
+
+    Each spec is a tuple of ``(model, kwargs, features)`` or
+    ``(model, kwargs, features, model_descr)``, where model is an
+    uninitialized sklearn (or pygam) model, kwargs is a dict of its
+    parameters, and features is a list of X column names, or None for all
+    columns. If model_descr is omitted, a description is generated from the
+    model name, kwargs and number of features.
+
+    X_train and X_test are converted to float64 NumPy arrays, and y_train
+    and y_test have their index reset, only once for the whole grid. The
+    specs are then fitted in parallel with ``joblib.Parallel`` on those
+    shared inputs, which the default process backend memory-maps to the
+    workers rather than copying them per spec.
+
+    :param specs: list of model specification tuples, as described above
+    :param X_train, X_test, y_train, y_test: the dataframes on which to fit and
+                                             evaluate the models
+    :param multioutput: Boolean, passed to generate_model_dict() for every
+                        spec (default multioutput=True)
+    :param n_jobs: integer or None, maximum number of specs fitted at once,
+                   if None the specs are fitted serially (default
+                   n_jobs=None)
+    :param predictions: Boolean, whether each model dict stores its
+                        predictions (default predictions=True)
+    :param y_stored: Boolean, whether each model dict stores the true y
+                     values, which are shared between the model dicts rather
+                     than copied (default y_stored=True)
+
+    :return: tuple of a pd.DataFrame with one row per spec and y variable
+             containing the spec number, description, number of features and
+             the train and test r2 scores, and the list of model dicts (as
+             returned by generate_model_dict()) in the order of specs
+    """
+    columns = list(X_train.columns)
+    X_train_np = np.asfortranarray(X_train.to_numpy(dtype=np.float64))
+    X_test_np = np.asfortranarray(X_test.to_numpy(dtype=np.float64))
+    y_train = y_train.reset_index(drop=True)
+    y_test = y_test.reset_index(drop=True)
+
+    grid = []
+    for spec in specs:
+        model, kwargs, features = spec[:3]
+        model_descr = (
+            spec[3]
+            if len(spec) > 3
+            else _grid_spec_descr(model, kwargs, features)
+        )
+        positions = (
+            None
+            if features is None
+            else [columns.index(feature) for feature in features]
+        )
+        grid.append((model, model_descr, positions, kwargs))
+
+    model_dicts = Parallel(n_jobs=n_jobs)(
+        delayed(_fit_grid_spec)(
+            model,
+            model_descr,
+            positions,
+            kwargs,
+            X_train_np,
+            X_test_np,
+            y_train,
+            y_test,
+            multioutput,
+            predictions,
+        )
+        for model, model_descr, positions, kwargs in grid
+    )
+
+    # every model dict references the same y values
+    if y_stored:
+        for model_dict in model_dicts:
+            model_dict["y_values"] = {"train": y_train, "test": y_test}
+
+    results = pd.DataFrame(
+        [
+            {
+                "spec": i,
+                "description": model_dict["description"],
+                "n_features": len(columns if positions is None else positions),
+                "y_variable": y_variable,
+                "train_score": model_dict["score"]["train"][j],
+                "test_score": model_dict["score"]["test"][j],
+            }
+            for i, (model_dict, (_, _, positions, _)) in enumerate(
+                zip(model_dicts, grid)
+            )
+            for j, y_variable in enumerate(model_dict["y_variables"])
+        ]
+    )
+
+    return results, model_dicts
 
 
 def print_model_results(model_dict, score="both"):
@@ -0,0 +1,323 @@
+"""
+caproj.results
+~~~~~~~~~~~~~~
+
+This module contains a compact record of fitted model results and an on-disk
+store for persisting and reloading large numbers of them
+
+**Module classes:**
+
+.. autosummary::
+
+   ModelResult
+   ResultStore
+
+"""
+
+import glob
+import json
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+
+
+class ModelResult:
+    """Compact record of the results of one fitted model
+
+    This holds the same information as the model dictionary returned by
+    :func:`caproj.model.generate_model_dict`, in fixed ``__slots__``
+    attributes rather than a nested dict, with the true y values,
+    predictions and scores held as NumPy arrays.
+
+    :param description: string describing the model
+    :param models: list of fitted model objects, or None if not loaded
+    :param y_variables: list of y variable names
+    :param formulas: list of statsmodels formula strings, empty if the
+                     statsmodels api was not used (default formulas=None)
+    :param y_values: dict of 'train' and 'test' arrays of true y values, or
+                     None if not stored (default y_values=None)
+    :param predictions: dict of 'train' and 'test' prediction arrays, or None
+                        if not stored (default predictions=None)
+    :param scores: dict of 'train' and 'test' r2 score arrays, or None if not
+                   stored (default scores=None)
+    """
+
+    __slots__ = (
+        "description",
+        "models",
+        "y_variables",
+        "formulas",
+        "y_values",
+        "predictions",
+        "scores",
+    )
+
+    def __init__(
+        self,
+        description,
+        models,
+        y_variables,
+        formulas=None,
+        y_values=None,
+        predictions=None,
+        scores=None,
+    ):
+        self.description = description
+        self.models = models
+        self.y_variables = list(y_variables)
+        self.formulas = list(formulas or [])
+        self.y_values = y_values
+        self.predictions = predictions
+        self.scores = scores
+
+    def __repr__(self):
+        return "ModelResult({!r})".format(self.description)
+
+    @staticmethod
+    def _arrays(split_dict):
+        """Converts a dict of train and test values to NumPy arrays"""
+        if split_dict is None:
+            return None
+
+        return {split: np.asarray(split_dict[split]) for split in split_dict}
+
+    @classmethod
+    def from_model_dict(cls, model_dict):
+        """Creates a ModelResult from a generate_model_dict() dictionary
+
+        :param model_dict: dict, output dictionary from the
+                           generate_model_dict() function
+
+        :return: ModelResult object
+        """
+        return cls(
+            model_dict["description"],
+            model_dict["model"],
+            model_dict["y_variables"],
+            model_dict["formulas"],
+            cls._arrays(model_dict.get("y_values")),
+            cls._arrays(model_dict.get("predictions")),
+            cls._arrays(model_dict.get("score")),
+        )
+
+    def to_model_dict(self):
+        """Returns the result as a generate_model_dict() style dictionary
+
+        The y values are returned as arrays rather than dataframes.
+
+        :return: dict, usable with ``caproj.model.print_model_results``
+        """
+        model_dict = {
+            "description": self.description,
+            "model": self.models,
+            "y_variables": self.y_variables,
+            "formulas": self.formulas,
+        }
+
+        for key, value in [
+            ("y_values", self.y_values),
+            ("predictions", self.predictions),
+            ("score", self.scores),
+        ]:
+            if value is not None:
+                model_dict[key] = value
+
+        return model_dict
+
+
+class ResultStore:
+    """On-disk store of ModelResult records
+
+    Each result is saved to its own subdirectory of ``store_dir``, holding a
+    ``meta.json`` file with its description, y variables, formulas and
+    scores, one ``.npy`` file per y value and prediction array, and its
+    fitted models in a separate ``models.joblib`` file. Arrays are
+    memory-mapped when loaded and the models are only loaded on request, so
+    any number of results can be persisted and compared via ``summary()``
+    without holding them all in memory.
+
+    :param store_dir: string path of the store directory, created if it does
+                      not exist
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+
+    def _path(self, result_id, filename=""):
+        """Returns the path of a result's directory, or of a file within it"""
+        return os.path.join(self.store_dir, result_id, filename)
+
+    def ids(self):
+        """Returns the ids of the stored results, sorted as strings
+
+        Sequential ids are zero-padded, so they sort in the order they were
+        saved, while custom ids sort alongside them as strings.
+
+        :return: list of string result ids
+        """
+        return sorted(
+            os.path.basename(os.path.dirname(path))
+            for path in glob.glob(os.path.join(self.store_dir, "*", "meta.json"))
+        )
+
+    def __len__(self):
+        return len(self.ids())
+
+    def __iter__(self):
+        """Yields the stored results one at a time, without their models"""
+        for result_id in self.ids():
+            yield self.load(result_id, load_models=False)
+
+    def save(self, result, result_id=None):
+        """Saves a result to the store
+
+        :param result: ModelResult object, or a generate_model_dict()
+                       dictionary
+        :param result_id: string id under which to save the result, if None
+                          the next sequential id is used, i.e. one more than
+                          the largest numeric id in the store (default
+                          result_id=None)
+
+        :return: string id of the saved result
+        """
+        if isinstance(result, dict):
+            result = ModelResult.from_model_dict(result)
+
+        if result_id is None:
+            numeric_ids = [int(i) for i in self.ids() if i.isdigit()]
+            result_id = "{:06d}".format(
+                max(numeric_ids) + 1 if numeric_ids else 0
+            )
+
+        os.makedirs(self._path(result_id), exist_ok=True)
+
+        arrays = {}
+        for name, split_dict in [
+            ("y_values", result.y_values),
+            ("predictions", result.predictions),
+        ]:
+            for split, values in (split_dict or {}).items():
+                filename = "{}_{}.npy".format(name, split)
+                np.save(self._path(result_id, filename), values)
+                arrays.setdefault(name, {})[split] = filename
+
+        if result.models is not None:
+            joblib.dump(result.models, self._path(result_id, "models.joblib"))
+
+        meta = {
+            "description": result.description,
+            "y_variables": result.y_variables,
+            "formulas": result.formulas,
+            "arrays": arrays,
+            "scores": None
+            if result.scores is None
+            else {
+                split: np.asarray(values, dtype=float).tolist()
+                for split, values in result.scores.items()
+            },
+        }
+
+        # meta.json is written last, marking the result as complete
+        with open(self._path(result_id, "meta.json"), "w") as f:
+            json.dump(meta, f)
+
+        return result_id
+
+    def load(self, result_id, mmap_mode="r", load_models=True):
+        """Loads a result from the store
+
+        :param result_id: string id of the result
+        :param mmap_mode: mmap_mode passed to ``np.load`` and ``joblib.load``,
+                          None reads the arrays into memory (default
+                          mmap_mode='r')
+        :param load_models: boolean, whether to load the fitted models, if
+                            False the models attribute is None (default
+                            load_models=True)
+
+        :return: ModelResult object
+        """
+        with open(self._path(result_id, "meta.json")) as f:
+            meta = json.load(f)
+
+        split_dicts = {
+            name: {
+                split: np.load(self._path(result_id, filename), mmap_mode)
+                for split, filename in files.items()
+            }
+            for name, files in meta["arrays"].items()
+        }
+
+        models_path = self._path(result_id, "models.joblib")
+        models = (
+            joblib.load(models_path, mmap_mode)
+            if load_models and os.path.exists(models_path)
+            else None
+        )
+
+        return ModelResult(
+            meta["description"],
+            models,
+            meta["y_variables"],
+            meta["formulas"],
+            split_dicts.get("y_values"),
+            split_dicts.get("predictions"),
+            None
+            if meta["scores"] is None
+            else {
+                split: np.array(values)
+                for split, values in meta["scores"].items()
+            },
+        )
+
+    def summary(self):
+        """Returns the scores of all stored results as a tidy dataframe
+
+        Only the ``meta.json`` file of each result is read.
+
+        :return: pd.DataFrame with one row per result and y variable, with
+                 the result id, description, y variable and train and test
+                 scores
+        """
+        rows = []
+
+        for result_id in self.ids():
+            with open(self._path(result_id, "meta.json")) as f:
+                meta = json.load(f)
+            scores = meta["scores"] or {}
+            n_outputs = len(meta["y_variables"])
+            train_scores = scores.get("train", [np.nan] * n_outputs)
+            test_scores = scores.get("test", [np.nan] * n_outputs)
+
+            for i, y_variable in enumerate(meta["y_variables"]):
+                rows.append(
+                    {
+                        "result_id": result_id,
+                        "description": meta["description"],
+                        "y_variable": y_variable,
+                        "train_score": train_scores[i],
+                        "test_score": test_scores[i],
+                    }
+                )
+
+        return pd.DataFrame(
+            rows,
+            columns=[
+                "result_id",
+                "description",
+                "y_variable",
+                "train_score",
+                "test_score",
+            ],
+        )
+
+    def remove(self, result_id):
+        """Removes a result from the store
+
+        :param result_id: string id of the result to remove
+        """
+        for path in glob.glob(self._path(result_id, "*")):
+            os.remove(path)
+        os.rmdir(self._path(result_id))
@@ -5,22 +5,573 @@ caproj.scale
 This module contains functions for scaling features of an X features design
 matrix and for encoding categorical variables
 
+**Module classes:**
+
+.. autosummary::
+
+   FeatureScaler
+   CategoryEncoder
+
 **Module functions:**
 
 .. autosummary::
 
    encode_categories
+   sparse_design_matrix
    scale_features
+   iter_parquet_chunks
+   transform_parquet
    sigmoid
    log_plus_one
 
 """
 
+import joblib
 import pandas as pd
 import numpy as np
+from scipy import sparse
 from sklearn.preprocessing import RobustScaler
 
 
+class CategoryEncoder:
+    """Fitted one-hot encoder for several categorical columns at once
+
+    The category vocabulary of each column is learned once by ``fit()`` (in
+    sorted order, as with ``pd.get_dummies``) or supplied with categories.
+    ``transform()`` then maps each column to integer codes against that
+    fixed vocabulary and fills a single uint8 block, so the output columns
+    are identical and identically ordered for any data, and categories not
+    seen during fitting are encoded as all zeros. With sparse=True the block
+    is a ``scipy.sparse`` CSR matrix instead, which suits high-cardinality
+    columns such as Client_Agency, and the column names are kept in the
+    ``feature_names_`` attribute.
+
+    :param columns: list of names of the categorical columns to encode
+    :param categories: optional dict mapping column names to the list of
+                       category values for that column, in the order their
+                       one-hot columns should appear, columns not in the
+                       dict have their categories learned in fit(),
+                       default=None
+    :param prefix_sep: string separating the column name and category value
+                       in the one-hot column names, as with pd.get_dummies,
+                       default="_"
+    :param sparse: boolean, if True transform() returns a CSR matrix rather
+                   than a dataframe, default=False
+    """
+
+    def __init__(self, columns, categories=None, prefix_sep="_", sparse=False):
+        self.columns = list(columns)
+        self.categories = categories or {}
+        self.prefix_sep = prefix_sep
+        self.sparse = sparse
+
+    def fit(self, df):
+        """Learns the category vocabulary of each column
+
+        :param df: pd.DataFrame containing the categorical columns
+
+        :return: the fitted CategoryEncoder object
+        """
+        self.categories_ = {
+            col: list(self.categories[col])
+            if col in self.categories
+            else sorted(df[col].dropna().unique())
+            for col in self.columns
+        }
+        self.feature_names_ = [
+            "{}{}{}".format(col, self.prefix_sep, cat)
+            for col in self.columns
+            for cat in self.categories_[col]
+        ]
+
+        return self
+
+    @classmethod
+    def from_feature_names(
+        cls, feature_names, columns, prefix_sep="_", sparse=False
+    ):
+        """Creates a fitted encoder from existing one-hot column names
+
+        This restores the encoder matching the columns produced by an earlier
+        ``pd.get_dummies`` call, i.e. a saved list of final feature names.
+        Feature names not prefixed by one of columns are ignored. The restored
+        categories are strings, and are cast to the dtype of each data column
+        when transforming non-string columns (i.e. integer codes).
+
+        :param feature_names: list of one-hot column names, i.e.
+                              ``["Borough_Bronx", "Borough_Queens", ...]``
+        :param columns: list of names of the categorical columns encoded
+        :param prefix_sep: string separating the column name and category
+                           value in feature_names, default="_"
+        :param sparse: boolean, passed to the CategoryEncoder, default=False
+
+        :return: fitted CategoryEncoder object
+        """
+        categories = {col: [] for col in columns}
+
+        # match the longest column prefix, in case column names share one
+        prefixes = sorted(columns, key=len, reverse=True)
+        for name in feature_names:
+            for col in prefixes:
+                prefix = "{}{}".format(col, prefix_sep)
+                if name.startswith(prefix):
+                    categories[col].append(name[len(prefix):])
+                    break
+
+        return cls(columns, categories, prefix_sep, sparse).fit(None)
+
+    def transform(self, df):
+        """One-hot encodes all columns in a single pass
+
+        :param df: pd.DataFrame containing the categorical columns
+
+        :return: pd.DataFrame of uint8 one-hot columns named feature_names_,
+                 with the index of df, or a uint8 scipy.sparse.csr_matrix
+                 with columns ordered as feature_names_ if sparse=True
+        """
+        if self.sparse:
+            return self._transform_sparse(df)
+
+        block = np.zeros((len(df), len(self.feature_names_)), dtype=np.uint8)
+        block[self._one_hot_positions(df)] = 1
+
+        return pd.DataFrame(block, columns=self.feature_names_, index=df.index)
+
+    def _one_hot_positions(self, df):
+        """Returns the row and column indices of the ones of the encoding"""
+        rows = np.arange(len(df))
+        row_list, col_list = [rows[:0]], [rows[:0]]
+        offset = 0
+
+        for col in self.columns:
+            vocab = self._column_categories(col, df[col])
+            # codes are -1 for missing values and unseen categories
+            codes = pd.Categorical(df[col], categories=vocab).codes
+            known = codes >= 0
+            row_list.append(rows[known])
+            col_list.append(offset + codes[known])
+            offset += len(vocab)
+
+        return np.concatenate(row_list), np.concatenate(col_list)
+
+    def _column_categories(self, col, values):
+        """Returns a column's categories cast to the dtype of its values"""
+        vocab = self.categories_[col]
+        dtype = (
+            values.dtype.categories.dtype
+            if pd.api.types.is_categorical_dtype(values.dtype)
+            else values.dtype
+        )
+
+        # string categories restored by from_feature_names() against
+        # non-string values, i.e. "1" against an integer column
+        if pd.api.types.is_object_dtype(dtype) or not all(
+            isinstance(cat, str) for cat in vocab
+        ):
+            return vocab
+
+        try:
+            if pd.api.types.is_bool_dtype(dtype):
+                bool_values = {"True": True, "False": False}
+                return [bool_values[cat] for cat in vocab]
+            return list(pd.Index(vocab).astype(dtype))
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(
+                "CategoryEncoder only accepts categories of {} that can be "
+                "cast to its {} dtype, but you have entered: {}".format(
+                    col, dtype, vocab
+                )
+            )
+
+    def _transform_sparse(self, df):
+        """One-hot encodes df as a uint8 CSR matrix"""
+        row_idx, col_idx = self._one_hot_positions(df)
+
+        return sparse.csr_matrix(
+            (np.ones(len(row_idx), dtype=np.uint8), (row_idx, col_idx)),
+            shape=(len(df), len(self.feature_names_)),
+        )
+
+    def fit_transform(self, df):
+        """Learns the category vocabularies and one-hot encodes df
+
+        :param df: pd.DataFrame containing the categorical columns
+
+        :return: pd.DataFrame of uint8 one-hot columns, or a CSR matrix if
+                 sparse=True
+        """
+        return self.fit(df).transform(df)
+
+
+def sparse_design_matrix(df, encoder, passthrough_cols=None):
+    """Builds a CSR design matrix of numeric and one-hot-encoded features
+
+    The passthrough columns are stored as they are, followed by the one-hot
+    columns of the fitted encoder, without materializing the dense one-hot
+    block. The result can be passed as X_train or X_test to
+    ``caproj.model.generate_model_dict`` for sklearn estimators accepting
+    sparse input.
+
+    :param df: pd.DataFrame containing the passthrough and categorical columns
+    :param encoder: fitted CategoryEncoder object
+    :param passthrough_cols: optional list of numeric column names to include
+                             ahead of the one-hot columns, default=None
+
+    :return: tuple of the float64 scipy.sparse.csr_matrix and the list of its
+             column names
+    """
+    passthrough_cols = list(passthrough_cols or [])
+
+    X = sparse.hstack(
+        [
+            sparse.csr_matrix(df[passthrough_cols].values, dtype=np.float64),
+            encoder._transform_sparse(df),
+        ],
+        format="csr",
+        dtype=np.float64,
+    )
+
+    return X, passthrough_cols + encoder.feature_names_
+
+
+def _scale_block(scaler, block):
+    """Applies a fitted scaler to a float array, in place if it supports it"""
+    # sklearn scalers with copy=False transform float arrays in place
+    if getattr(scaler, "copy", None) is not True:
+        return scaler.transform(block)
+
+    scaler.copy = False
+    try:
+        return scaler.transform(block)
+    finally:
+        scaler.copy = True
+
+
+class FeatureScaler:
+    """Fitted feature scaling artifact, reusable across datasets
+
+    Holds everything ``scale_features()`` derives from the training data,
+    i.e. the column order, the scaled columns, the before and after
+    functions and the fitted sklearn scaler(s), so that the scaling can be
+    fit once and then applied to any number of validation, test or scoring
+    dataframes with ``transform()``. A fitted FeatureScaler can be saved to
+    disk with ``save()`` and restored with ``FeatureScaler.load()``, in
+    which case scale_before_func and scale_after_func must be importable
+    functions (i.e. ``np.log`` or ``caproj.scale.sigmoid``, not lambdas).
+
+    :param exclude_scale_cols: Optional list containing names of columns we
+                               do not wish to scale, default=None
+    :param scaler: The sklearn scaler method used to fit the data (i.e.
+                   StandardScaler, MinMaxScaler, RobustScaler, etc.),
+                   default=RobustScaler
+    :param scale_before_func: Optional function applied to the data prior to
+                              the scaler, default=None
+    :param scale_after_func: Optional function applied to the data after the
+                             scaler, default=None
+    :param reapply_scaler: Boolean, if set to True, a second scaler is fitted
+                           after the scale_after_func is applied, default is
+                           reapply_scaler=False
+    :param kwargs: Any additional arguments are passed as parameters to the
+                   selected scaler
+    """
+
+    def __init__(
+        self,
+        exclude_scale_cols=None,
+        scaler=RobustScaler,
+        scale_before_func=None,
+        scale_after_func=None,
+        reapply_scaler=False,
+        **kwargs
+    ):
+        self.exclude_scale_cols = list(exclude_scale_cols or [])
+        self.scaler = scaler
+        self.scale_before_func = scale_before_func
+        self.scale_after_func = scale_after_func
+        self.reapply_scaler = reapply_scaler
+        self.scaler_kwargs = kwargs
+
+    def fit(self, train_df):
+        """Fits the scaler(s) on the training data
+
+        :param train_df: The training data
+
+        :return: the fitted FeatureScaler object
+        """
+        # create list of columns to ensure proper ordering of columns for output
+        self.columns_ = list(train_df)
+
+        # create list of non-binary column names for scaling
+        self.scaled_columns_ = train_df.columns.difference(
+            self.exclude_scale_cols
+        )
+
+        # apply initial scaling if specified
+        if self.scale_before_func:
+            train_df = self.scale_before_func(
+                train_df.copy()[self.scaled_columns_]
+            )
+
+        # list of fitted scaler objects, fitted on arrays so that they accept
+        # both the dataframes and the float blocks passed to transform()
+        self.scalers_ = [
+            self.scaler(**self.scaler_kwargs).fit(
+                train_df[self.scaled_columns_].values
+            )
+        ]
+
+        if self.reapply_scaler:
+            scaled_train_df = pd.DataFrame(
+                self.scalers_[0].transform(
+                    train_df[self.scaled_columns_].values
+                ),
+                columns=self.scaled_columns_,
+            )
+
+            if self.scale_after_func:
+                scaled_train_df = self.scale_after_func(scaled_train_df.copy())
+
+            self.scalers_.append(
+                self.scaler(**self.scaler_kwargs).fit(
+                    scaled_train_df[self.scaled_columns_].values
+                )
+            )
+
+        return self
+
+    def transform(self, df, copy=True):
+        """Scales a dataframe with the fitted scaler(s)
+
+        If copy=False, the scaled columns are gathered into one contiguous
+        float64 array, the before function, scaler(s) and after function are
+        applied to that array (in place where the sklearn scaler supports
+        it) and the result is written back into df. The excluded columns are
+        left untouched rather than copied, and df keeps its index and column
+        order. In that case scale_before_func and scale_after_func receive
+        and must return a 2D np.ndarray (as np.log, ``sigmoid()`` and
+        ``log_plus_one()`` do).
+
+        :param df: Your test/validation data, containing the same columns as
+                   the training data
+        :param copy: boolean, if False df itself is scaled and returned
+                     rather than a scaled copy of it (default copy=True)
+
+        :return: a feature-scaled version of df, with its index reset and its
+                 columns ordered as in the training data, or df itself if
+                 copy=False
+        """
+        if not copy:
+            return self._transform_inplace(df)
+
+        scaled_df = df.copy()[self.scaled_columns_]
+
+        # apply initial scaling if specified
+        if self.scale_before_func:
+            scaled_df = self.scale_before_func(scaled_df.copy())
+
+        scaled_df = pd.DataFrame(
+            self.scalers_[0].transform(np.asarray(scaled_df)),
+            columns=self.scaled_columns_,
+        )
+
+        if self.scale_after_func:
+            scaled_df = self.scale_after_func(scaled_df.copy())
+
+        if self.reapply_scaler:
+            scaled_df = pd.DataFrame(
+                self.scalers_[1].transform(np.asarray(scaled_df)),
+                columns=self.scaled_columns_,
+            )
+
+        # merge scaled columns with unscaled columns
+        return pd.concat(
+            [
+                df.drop(self.scaled_columns_, axis=1).reset_index(drop=True),
+                scaled_df,
+            ],
+            axis=1,
+        )[self.columns_]
+
+    def _transform_inplace(self, df):
+        """Scales the scaled columns of df as a single float block in place"""
+        block = df[self.scaled_columns_].to_numpy(dtype=np.float64)
+
+        if self.scale_before_func:
+            block = self.scale_before_func(block)
+
+        block = _scale_block(self.scalers_[0], block)
+
+        if self.scale_after_func:
+            block = self.scale_after_func(block)
+
+        if self.reapply_scaler:
+            block = _scale_block(self.scalers_[1], block)
+
+        df[self.scaled_columns_] = block
+
+        return df
+
+    def partial_fit(self, train_chunk):
+        """Incrementally fits the scaler on one chunk of the training data
+
+        Only scalers implementing ``partial_fit`` (i.e. StandardScaler and
+        MinMaxScaler) are supported, and reapply_scaler must be False since
+        the second scaler can only be fitted once the first is complete. The
+        columns of the first chunk determine the column order.
+
+        :param train_chunk: pd.DataFrame chunk of the training data
+
+        :return: the partially fitted FeatureScaler object
+        """
+        if not hasattr(self.scaler, "partial_fit"):
+            raise ValueError(
+                "partial_fit only accepts scalers implementing partial_fit "
+                "(i.e. StandardScaler, MinMaxScaler), but you have entered: "
+                "{}".format(self.scaler.__name__)
+            )
+        if self.reapply_scaler:
+            raise ValueError(
+                "partial_fit only accepts reapply_scaler=False, but you have "
+                "entered: {}".format(self.reapply_scaler)
+            )
+
+        if not hasattr(self, "scalers_"):
+            self.columns_ = list(train_chunk)
+            self.scaled_columns_ = train_chunk.columns.difference(
+                self.exclude_scale_cols
+            )
+            self.scalers_ = [self.scaler(**self.scaler_kwargs)]
+
+        train_chunk = train_chunk[self.scaled_columns_]
+
+        if self.scale_before_func:
+            train_chunk = self.scale_before_func(train_chunk.copy())
+
+        self.scalers_[0].partial_fit(np.asarray(train_chunk))
+
+        return self
+
+    def fit_chunks(self, chunks):
+        """Fits the scaler on an iterator of training data chunks
+
+        :param chunks: iterable of pd.DataFrame chunks of the training data,
+                       i.e. the output of ``iter_parquet_chunks()``
+
+        :return: the fitted FeatureScaler object
+        """
+        for chunk in chunks:
+            self.partial_fit(chunk)
+
+        return self
+
+    def transform_chunks(self, chunks, copy=True):
+        """Lazily scales an iterator of dataframe chunks
+
+        :param chunks: iterable of pd.DataFrame chunks
+        :param copy: boolean, passed to transform() (default copy=True)
+
+        :return: generator of scaled pd.DataFrame chunks
+        """
+        for chunk in chunks:
+            yield self.transform(chunk, copy)
+
+    def fit_transform(self, train_df):
+        """Fits the scaler(s) on the training data and scales it
+
+        :param train_df: The training data
+
+        :return: a feature-scaled version of train_df
+        """
+        return self.fit(train_df).transform(train_df)
+
+    def save(self, filepath):
+        """Saves the fitted FeatureScaler to disk with joblib
+
+        :param filepath: string path of the file to which it is saved
+        """
+        joblib.dump(self, filepath)
+
+    @classmethod
+    def load(cls, filepath):
+        """Loads a FeatureScaler previously saved with ``FeatureScaler.save()``
+
+        :param filepath: string path of the saved FeatureScaler
+
+        :return: the loaded FeatureScaler object
+        """
+        return joblib.load(filepath)
+
+
+def _import_pyarrow():
+    """Imports pyarrow, which is only required for the Parquet functions"""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError(
+            "Reading and writing Parquet files requires the pyarrow package, "
+            "which can be installed with: pip install pyarrow"
+        )
+
+    return pyarrow, pyarrow.parquet
+
+
+def iter_parquet_chunks(filepath, columns=None):
+    """Reads a Parquet file as a stream of dataframes, one per row group
+
+    :param filepath: string path of the Parquet file
+    :param columns: optional list of column names to read, default=None reads
+                    all columns
+
+    :return: generator of pd.DataFrame chunks
+    """
+    _, pq = _import_pyarrow()
+    parquet_file = pq.ParquetFile(filepath)
+
+    for i in range(parquet_file.num_row_groups):
+        yield parquet_file.read_row_group(i, columns=columns).to_pandas()
+
+
+def transform_parquet(feature_scaler, filepath, save_path, copy=True):
+    """Scales a Parquet file chunk by chunk, without loading it into memory
+
+    Each row group of the input file is read, scaled with the fitted
+    feature_scaler and appended to the output file as a row group of its own,
+    so memory use is bounded by the row group size of the input file.
+
+    :param feature_scaler: fitted FeatureScaler object, i.e. one restored with
+                           ``FeatureScaler.load()``
+    :param filepath: string path of the Parquet file to scale
+    :param save_path: string path of the scaled Parquet file to write
+    :param copy: boolean, passed to FeatureScaler.transform(), copy=False
+                 avoids copying each chunk (default copy=True)
+
+    :return: integer number of rows written
+    """
+    pa, pq = _import_pyarrow()
+    writer = None
+    n_rows = 0
+
+    try:
+        for chunk in feature_scaler.transform_chunks(
+            iter_parquet_chunks(filepath), copy
+        ):
+            table = pa.Table.from_pandas(
+                chunk,
+                schema=writer.schema if writer else None,
+                preserve_index=False,
+            )
+            if writer is None:
+                writer = pq.ParquetWriter(save_path, table.schema)
+            writer.write_table(table)
+            n_rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    return n_rows
+
+
 def scale_features(
     train_df,
     val_df,
@@ -29,6 +580,7 @@ def scale_features(
     scale_before_func=None,
     scale_after_func=None,
     reapply_scaler=False,
+    copy=True,
     **kwargs
 ):
     """Scales val_df features based on train_df and returns scaled dataframe
@@ -36,6 +588,10 @@ def scale_features(
     Accepts various sklearn scalers and allows you to specify features you do
     not want affected by scaling by using the exclude_scale_cols parameter.
 
+    The scaler(s) are refit on train_df on every call. To fit once and scale
+    several dataframes, or to persist the fitted scaling, use
+    ``FeatureScaler`` instead.
+
     NOTE:
 
         Be certain to reset the index of your accompanying y_train and y_test
@@ -62,6 +618,9 @@ def scale_features(
                            maintain a 0 to 1 scale after applying a secondary
                            transformation to the data), default is
                            reapply_scaler=False
+    :param copy: Boolean, if set to False val_df itself is scaled in place as
+                 described in ``FeatureScaler.transform()``, which avoids
+                 copying wide dataframes, default is copy=True
     :param kwargs: Any additional arguments are passed as parameters to the
                    selected scaler (for instance feature_range=(-1,1) would be
                    an appropriate argument if scaler is set to MinMaxScaler)
@@ -71,58 +630,17 @@ def scale_features(
              either be of length 1 or 2 depending on whether reapply_scaler was
              set to True
     """
-    # create list of columns to ensure proper ordering of columns for output df
-    col_list = list(train_df)
-
-    # create list of non-binary column names for scaling
-    scaled_columns = train_df.columns.difference(exclude_scale_cols)
-
-    scaled_val_df = val_df.copy()[scaled_columns]
-
-    # apply initial scaling if specified
-    if scale_before_func:
-        train_df = scale_before_func(train_df.copy()[scaled_columns])
-        scaled_val_df = scale_before_func(scaled_val_df.copy())
-
-    # initialize list for storing fitted scaler objects
-    Scaler = []
-
-    # create Scaler instance fitted on non-binary train data
-    Scaler.append(scaler(**kwargs).fit(train_df[scaled_columns]))
-
-    # scale val_df and convert to dataframe with column names
-    scaled_train_df = pd.DataFrame(
-        Scaler[0].transform(train_df[scaled_columns]), columns=scaled_columns,
-    )
-
-    scaled_val_df = pd.DataFrame(
-        Scaler[0].transform(scaled_val_df), columns=scaled_columns,
-    )
-
-    # apply initial scaling if specified
-    if scale_after_func:
-        scaled_train_df = scale_after_func(scaled_train_df.copy())
-        scaled_val_df = scale_after_func(scaled_val_df.copy())
-
-    # create StandardScaler instance fitted on non-binary train data
-    if reapply_scaler:
-        Scaler.append(scaler(**kwargs).fit(scaled_train_df[scaled_columns]))
-
-        scaled_val_df = pd.DataFrame(
-            Scaler[1].transform(scaled_val_df), columns=scaled_columns,
-        )
-
-    # merge scaled columns with unscaled columns
-    scaled_df = pd.concat(
-        [
-            val_df.drop(scaled_columns, axis=1).reset_index(drop=True),
-            scaled_val_df.copy(),
-        ],
-        axis=1,
-    )[col_list]
+    feature_scaler = FeatureScaler(
+        exclude_scale_cols,
+        scaler,
+        scale_before_func,
+        scale_after_func,
+        reapply_scaler,
+        **kwargs
+    ).fit(train_df)
 
     # Return full scaled val dataframe and fitted Scaler object list
-    return scaled_df, Scaler
+    return feature_scaler.transform(val_df, copy), feature_scaler.scalers_
 
 
 def sigmoid(x):
@@ -196,6 +714,9 @@ def encode_categories(
 
     :return: pd.DataFrame of the original input dataframe with the additional
              encoded category column(s) appended to it.
+
+    To one-hot-encode several columns against a vocabulary that is learned
+    once and reused for new data, use ``CategoryEncoder`` instead.
     """
     # copy dataframe to prevent overwrite if not desired
     data_copy = data.copy()
@@ -546,6 +546,7 @@ def calc_models(
     descr_attributes,
     responses_list,
     logistic=True,
+    store=None,
 ):
     """Iterate over all combinations of attributes to return lists of resulting models
 
@@ -568,13 +569,24 @@ def calc_models(
             (i.e. ``logistic=True``) or regressor (i.e. ``logistic=False``),
             defaults to True
     :type logistic: bool, optional
+    :param store: Optional store to which each fitted model dictionary is saved
+            as it is generated, rather than being kept in memory, in which case
+            the second returned list contains the ids of the stored results,
+            defaults to None
+    :type store: :class:`caproj.results.ResultStore`, optional
     :return: Two list objects containing (1) lists of dictionaries of model results and
-            (2) lists of fitted model dictionaries for each iterated model
+            (2) lists of fitted model dictionaries (or their result ids if a
+            store is used) for each iterated model
     :rtype: tuple
     """
     results_all = []
     model_dicts = []
 
+    def keep_model_dicts(model_dict):
+        if store is None:
+            return model_dict
+        return [store.save(d) for d in model_dict]
+
     print(f"Using {'LOGISTIC' if logistic else 'REGRESSION'} models")
     for i in tqdm(range(1, len(nondescr_attrbutes))):
         alist = list(itertools.combinations(nondescr_attrbutes, i))
@@ -589,7 +601,7 @@ def calc_models(
                 logistic=logistic,
             )
             results_all += results
-            model_dicts += model_dict
+            model_dicts += keep_model_dicts(model_dict)
             for d_emb in tqdm(descr_attributes, leave=False):
                 results, model_dict = calculate(
                     data_train,
@@ -600,6 +612,6 @@ def calc_models(
                     logistic=logistic,
                 )
                 results_all += results
-                model_dicts += model_dict
+                model_dicts += keep_model_dicts(model_dict)
 
     return results_all, model_dicts
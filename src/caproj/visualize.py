@@ -31,6 +31,8 @@ import matplotlib.pyplot as plt
 
 from sklearn.metrics import r2_score
 
+from .datagen import ProjectIndex
+
 
 def plot_value_counts(value_counts, figsize=(9, 3), color="tab:blue"):
     """Generates barplot from pandas value_counts series
@@ -509,7 +511,10 @@ def plot_change_trend(trend_data, pid_data, pid, interval=None):
     Generates image of 4 subplots, no objects are returned.
 
     :param trend_data: pd.DataFrame, the cleaned dataset of all project change
-                       records (i.e. 'Capital_Projects_clean.csv' dataframe)
+                       records (i.e. 'Capital_Projects_clean.csv' dataframe),
+                       or a ``caproj.datagen.ProjectIndex`` of those records,
+                       which avoids scanning the full dataset when plotting
+                       many projects
     :param pid_data: pd.DataFrame, the prediction_interval dataframe produced
                      using this project's data generator function
                      (i.e. 'NYC_Capital_Projects_3yr.csv' dataframe)
@@ -538,12 +543,18 @@ def plot_change_trend(trend_data, pid_data, pid, interval=None):
     pid_record = pid_data.copy().loc[pid_data["PID"] == pid]
 
     # subset project changes data (clean original dataset)
-    changes_loc = (
-        (trend_data["PID"] == pid) & (trend_data["Change_Year"] <= interval)
-        if interval
-        else trend_data["PID"] == pid
-    )
-    pid_changes = trend_data.copy().loc[changes_loc]
+    if isinstance(trend_data, ProjectIndex):
+        pid_changes = trend_data.project(pid)
+        if interval:
+            pid_changes = pid_changes.loc[pid_changes["Change_Year"] <= interval]
+        pid_changes = pid_changes.copy()
+    else:
+        changes_loc = (
+            (trend_data["PID"] == pid) & (trend_data["Change_Year"] <= interval)
+            if interval
+            else trend_data["PID"] == pid
+        )
+        pid_changes = trend_data.copy().loc[changes_loc]
 
     # convert datetime field to correct data type
     pid_changes["Date_Reported_As_Of"] = pd.to_datetime(
@@ -1,7 +1,20 @@
 import logging
+import os
 from unittest import TestCase
 
+import numpy as np
+import pandas as pd
+
 from caproj.cli import main
+from caproj.datagen import (
+    IntervalStateStore,
+    change_feature_columns,
+    compute_change_features,
+    generate_interval_data,
+)
+from caproj.ingest import ingest_change_records
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "data")
 
 
 def test_main():
@@ -20,3 +33,84 @@ class TestNullHandler(TestCase):
         """Ensure logging.nullHandler is initialized with module"""
         logger = logging.getLogger("caproj")
         self.assertIsInstance(logger.handlers[0], logging.NullHandler)
+
+
+def test_main_ingest(tmp_path):
+    """Ensure the ingest command reproduces the cleaned change records"""
+    save_path = tmp_path / "Capital_Projects_clean.csv"
+    main(
+        [
+            "ingest",
+            os.path.join(DATA_DIR, "raw", "NYC_capital_projects_20190901.csv"),
+            str(save_path),
+        ]
+    )
+    data = pd.read_csv(save_path)
+    assert len(data) == 2095
+
+    pid_3 = data[data["PID"] == 3].head(3)
+    assert pid_3["Current_Phase"].tolist() == [
+        "2-Design",
+        "3-Construction Procurement",
+        "3-Construction Procurement",
+    ]
+    assert (pid_3["Original_Schedule"] == "2020-01-13").all()
+    assert pid_3["Change_Years"].round(2).tolist() == [0.6, 1.36, 1.85]
+    assert pid_3["Change_Year"].tolist() == [1, 2, 2]
+    assert pid_3["Current_Project_Years"].round(2).tolist() == [5.94] * 3
+    assert pid_3["Current_Project_Year"].tolist() == [6] * 3
+
+    df_3yr = generate_interval_data(data, change_year_interval=3, verbose=0)
+    assert df_3yr["PID"].nunique() == 149
+
+
+def test_interval_state_store_snapshot_update(tmp_path):
+    """Ensure applying a separately ingested snapshot matches a full rerun"""
+    raw_path = os.path.join(
+        DATA_DIR, "raw", "NYC_capital_projects_20190901.csv"
+    )
+    raw = pd.read_csv(raw_path)
+    dates = pd.to_datetime(raw["Date Reported As Of"])
+    last_snapshot = dates == dates.max()
+    raw[~last_snapshot].to_csv(tmp_path / "history.csv", index=False)
+    raw[last_snapshot].to_csv(tmp_path / "snapshot.csv", index=False)
+
+    store = IntervalStateStore([None, 3])
+    store.update(ingest_change_records(tmp_path / "history.csv", verbose=0))
+    interval_dict = store.update(
+        ingest_change_records(tmp_path / "snapshot.csv", verbose=0)
+    )
+
+    data = ingest_change_records(raw_path, verbose=0)
+    for change_year_interval in [None, 3]:
+        pd.testing.assert_frame_equal(
+            interval_dict[change_year_interval],
+            generate_interval_data(data, change_year_interval, verbose=0),
+        )
+
+
+def test_compute_change_features_missing_inputs():
+    """Ensure missing inputs give nan ratios, with or without zero_division"""
+    design_start = pd.to_datetime(["2020-01-01", "2020-01-01"])
+    schedule_end = pd.to_datetime([None, "2020-01-11"])
+    budget_start = [0.0, 0.0]
+    budget_end = [np.nan, 5.0]
+    ratio_positions = [
+        change_feature_columns.index(col)
+        for col in change_feature_columns
+        if "Ratio" in col or "Error" in col
+    ]
+
+    for zero_division in [None, 0.0]:
+        features = compute_change_features(
+            design_start,
+            design_start,
+            schedule_end,
+            budget_start,
+            budget_end,
+            zero_division=zero_division,
+        )
+        assert np.isnan(features[0, ratio_positions]).all()
+
+        if zero_division is not None:
+            assert np.isfinite(features[1, ratio_positions]).all()